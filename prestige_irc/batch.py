@@ -0,0 +1,59 @@
+from prestige_irc.commands import Commands
+from prestige_irc.message import IRCBatch
+
+
+class BatchAggregator(object):
+
+    """
+    A processor for `Connection.add_processor` which collects the messages of IRCv3 batches,
+    so that each batch, such as a netsplit or a chat history playback, reaches the listeners as a single `IRCBatch`
+    instead of one message at a time.
+
+    Messages which are not part of a batch are passed on unchanged.
+    """
+
+    def __init__(self):
+        """Creates the aggregator with no open batches."""
+        # Maps the references of batches which have been opened, but not yet closed, to the batches.
+        self.__open = {}
+
+    def __call__(self, connection, message):
+        """
+        Adds `message` to the batch it belongs to.
+
+        Parameters
+        ----------
+        connection: Connection
+            The connection the message was received over.
+        message: IRCMessage
+            The message received.
+
+        Returns
+        -------
+        IRCMessage|None:
+            The completed batch if `message` closes a batch which is not nested in another batch,
+            `message` if it is not part of a batch, otherwise None.
+        """
+        if message.command == Commands.BATCH and message.target:
+            reference = message.target[1:]
+            if message.target[0] == '+':
+                self.__open[reference] = IRCBatch(message.raw)
+                return None
+            if message.target[0] == '-':
+                batch = self.__open.pop(reference, None)
+                if batch is None:
+                    return message
+                return self.__add(batch)
+        return self.__add(message)
+
+    def __add(self, message):
+        """Adds a message or completed batch to its enclosing batch, returning it if it has none."""
+        batch = self.__open.get(message.tags.get('batch'))
+        if batch is None:
+            return message
+        batch.messages.append(message)
+        return None
+
+    def clear(self):
+        """Discards every open batch, e.g. after the connection has been lost."""
+        self.__open.clear()
@@ -0,0 +1,529 @@
+import bisect
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+from prestige_irc.commands import Commands
+from prestige_irc.message import CHANNEL_PREFIXES, IRCMessage, irc_lower
+
+# An index entry: the hash of the channel, the time of the entry, the offset of its record in the segment, and the
+# earliest time of the records of the channel since its previous entry.
+INDEX_ENTRY = struct.Struct('<QdQd')
+
+_SEGMENT_NAME = re.compile(r'^(\d{8})\.log$')
+
+
+def channel_hash(channel):
+    """
+    Hashes a lowercased channel name into the 64-bit key used by the index.
+
+    Parameters
+    ----------
+    channel: str
+        The lowercased channel name.
+
+    Returns
+    -------
+    int:
+        The hash of the channel.
+    """
+    return int.from_bytes(hashlib.blake2b(channel.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _scan_range(times, offsets, lows, since, until, complete):
+    """
+    Finds the part of a segment to read for the records of a channel between `since` and `until`.
+
+    Parameters
+    ----------
+    times, offsets, lows: list
+        The times, offsets and earliest times of the entries of the channel, in the order they were written.
+    since, until: float
+        The range of times to read.
+    complete: bool
+        If the records after the last entry are known to be none, which is the case for the final entries
+        written when a segment is sealed.
+
+    Returns
+    -------
+    tuple|None:
+        The offsets to read from and up to, where an end of None reads up to the end of the segment,
+        or None if the channel has no entries.
+    """
+    if not times:
+        return None
+    # Entry times only increase, so every record before the last entry before `since` is earlier than `since`.
+    first = max(0, bisect.bisect_left(times, since) - 1)
+    # Every record from an entry on is after `until` if the earliest time of each span from the entry on is.
+    end = None
+    after = float('inf') if complete else float('-inf')
+    for i in range(len(times) - 1, first - 1, -1):
+        if after <= until:
+            break
+        end = offsets[i]
+        after = min(after, lows[i])
+    return offsets[first], end
+
+
+class _SealedIndex(object):
+
+    """A read-only view of a sorted index file, searched in place through `mmap`."""
+
+    def __init__(self, buffer):
+        self.__buffer = buffer
+        self.__length = len(buffer) // INDEX_ENTRY.size
+
+    def __entry(self, i):
+        return INDEX_ENTRY.unpack_from(self.__buffer, i * INDEX_ENTRY.size)
+
+    def entries(self, key):
+        """
+        Finds the entries of a channel.
+
+        Returns
+        -------
+        list:
+            The (time, offset, earliest time) of each entry of the channel, in the order they were written.
+        """
+        low, high = 0, self.__length
+        while low < high:
+            middle = (low + high) // 2
+            if self.__entry(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        while low < self.__length:
+            entry = self.__entry(low)
+            if entry[0] != key:
+                break
+            entries.append(entry[1:])
+            low += 1
+        return entries
+
+
+class _ActiveIndex(object):
+
+    """The index of the segment being written, kept in memory by the writer thread."""
+
+    def __init__(self):
+        # Maps each channel hash to the times, offsets and earliest times of its entries, in the order they were
+        # written.
+        self.times = {}
+        self.offsets = {}
+        self.lows = {}
+        # The offset of the last indexed record, the latest time, and the earliest time since the last entry
+        # of each channel; only used by the writer.
+        self.last_offsets = {}
+        self.latest = {}
+        self.span_lows = {}
+
+    def scan_range(self, key, since, until):
+        # The records after the last entry are still being written, so they are always read.
+        return _scan_range(self.times.get(key), self.offsets.get(key), self.lows.get(key), since, until, False)
+
+
+class ChatLog(object):
+
+    """
+    An append-only log of channel messages, written to segment files in a directory.
+
+    Messages are queued by the processor and written by a background thread in batches, so receiving a message costs
+    neither a system call nor an fsync. Segments are rotated once they reach a size limit, and are fsynced at a
+    configurable interval.
+
+    Each segment `NNNNNNNN.log` holds one record per line, `timestamp<TAB>channel<TAB>raw line`, and is accompanied by
+    a sparse index `NNNNNNNN.idx` of `INDEX_ENTRY`s: an entry is written for the first record of each channel, and
+    after every `index_interval` bytes of the segment for each channel. When a segment is sealed, a final entry is
+    written for each channel at the end of the segment.
+    Once a segment is rotated, its index is sorted by channel and time, so reading the history of a channel
+    binary searches the memory-mapped index and only reads the records of the segment between the entries found:
+    from the last entry before the start of the range, up to the first entry after which every record of the channel
+    is past its end.
+    """
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, flush_interval=0.5, batch_size=65536,
+                 fsync_interval=5.0, index_interval=65536, commands=(Commands.PRIVMSG, Commands.NOTICE),
+                 casemapping='rfc1459'):
+        """
+        Readies the log; call `start` to run the writer thread, and add it with `Connection.add_processor`.
+
+        The log is a processor rather than a listener since processors see the messages in the order they were
+        received, one at a time, so the records are written in that order.
+
+        Parameters
+        ----------
+        directory: str
+            The directory the segments are written to. It is created if it does not exist.
+        segment_size: int (optional)
+            The size in bytes after which a new segment is started.
+            Default value is 64 MiB.
+        flush_interval: float (optional)
+            The maximum number of seconds a queued message waits before it is written.
+            Default value is 0.5.
+        batch_size: int (optional)
+            The number of queued bytes which triggers a write before `flush_interval` has passed.
+            Default value is 65536.
+        fsync_interval: float (optional)
+            The number of seconds between fsyncs of the segment being written; 0 fsyncs after every write.
+            Segments are always fsynced when they are rotated and when the log is stopped.
+            Default value is 5.0.
+        index_interval: int (optional)
+            The number of bytes of a segment between two index entries of the same channel.
+            Default value is 65536.
+        commands: collections.iterable (optional)
+            The commands of the messages which are logged when used as a processor.
+            Default value is PRIVMSG and NOTICE.
+        casemapping: str (optional)
+            The casemapping used to compare channel names, see `irc_lower`.
+            Default value is 'rfc1459'.
+        """
+        self.__directory = directory
+        self.__segment_size = segment_size
+        self.__flush_interval = flush_interval
+        self.__batch_size = batch_size
+        self.__fsync_interval = fsync_interval
+        self.__index_interval = index_interval
+        self.__commands = frozenset(commands)
+        self.__casemapping = casemapping
+        # Records waiting to be written, as (timestamp, channel, line) tuples, and their total size.
+        self.__pending = []
+        self.__pending_size = 0
+        self.__queued = 0
+        self.__written = 0
+        self.__flushing = False
+        self.__condition = threading.Condition()
+        self.__stopping = False
+        self.__thread = None
+        # The segment being written, its files, size and index; only the writer thread changes them.
+        self.__number = None
+        self.__log_file = None
+        self.__index_file = None
+        self.__size = 0
+        self.__index = None
+        self.__last_sync = 0.0
+        # Held while the writer changes the segment or its index, and while readers take a snapshot of them.
+        self.__lock = threading.Lock()
+
+    def __call__(self, connection, message):
+        """
+        A processor which logs channel messages with the configured commands.
+
+        Parameters
+        ----------
+        connection: Connection
+            The connection the message was received over.
+        message: IRCMessage
+            The message received.
+
+        Returns
+        -------
+        IRCMessage:
+            `message`, unchanged.
+        """
+        if message.command in self.__commands and message.target[:1] in CHANNEL_PREFIXES:
+            self.append(channel=message.target, line=message.encoded, timestamp=message.time)
+        return message
+
+    @property
+    def segments(self):
+        """
+        Returns
+        -------
+        list:
+            The paths of the segment files in the directory, oldest first.
+        """
+        return [self.__path(number, '.log') for number in self.__segment_numbers()]
+
+    def start(self):
+        """Starts a new segment and the writer thread. Does nothing if the log is already running."""
+        if self.__thread is not None:
+            return
+        os.makedirs(self.__directory, exist_ok=True)
+        numbers = self.__segment_numbers()
+        if numbers:
+            # The last segment may not have been sealed if the process was killed.
+            self.__seal(numbers[-1])
+        self.__open_segment(numbers[-1] + 1 if numbers else 0)
+        self.__stopping = False
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Writes every queued message, fsyncs and seals the current segment, and stops the writer thread."""
+        if self.__thread is None:
+            return
+        with self.__condition:
+            self.__stopping = True
+            self.__condition.notify_all()
+        self.__thread.join()
+        self.__thread = None
+        self.__close_segment()
+
+    def append(self, channel, line, timestamp=None):
+        """
+        Queues a line to be logged.
+
+        Parameters
+        ----------
+        channel: str
+            The channel the line was sent to.
+        line: bytes
+            The raw line, without a line ending.
+        timestamp: float (optional)
+            The time the line was received, in seconds since the epoch.
+            Default value is None, which uses the current time.
+        """
+        record = (time.time() if timestamp is None else timestamp, irc_lower(channel, self.__casemapping), line)
+        with self.__condition:
+            self.__pending.append(record)
+            self.__pending_size += len(line)
+            self.__queued += 1
+            if self.__pending_size >= self.__batch_size:
+                self.__condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Waits until every line queued so far has been written to the segment files; they are not necessarily fsynced.
+
+        Parameters
+        ----------
+        timeout: float (optional)
+            The maximum number of seconds to wait.
+            Default value is None, which waits indefinitely.
+
+        Returns
+        -------
+        bool:
+            If every line was written before the timeout.
+        """
+        with self.__condition:
+            target = self.__queued
+            self.__flushing = True
+            self.__condition.notify_all()
+            return self.__condition.wait_for(lambda: self.__written >= target or self.__thread is None, timeout)
+
+    def read(self, channel, since=None, until=None, limit=None):
+        """
+        Reads the logged lines of `channel` which have been written to the segment files.
+
+        Parameters
+        ----------
+        channel: str
+            The channel.
+        since: float (optional)
+            Only lines logged at or after this time, in seconds since the epoch, are returned.
+            Default value is None.
+        until: float (optional)
+            Only lines logged at or before this time, in seconds since the epoch, are returned.
+            Default value is None.
+        limit: int (optional)
+            The maximum number of lines to return; the most recent lines are kept.
+            Default value is None, which returns every line.
+
+        Returns
+        -------
+        list:
+            (timestamp, bytes) tuples, oldest first.
+        """
+        channel = irc_lower(channel, self.__casemapping)
+        key = channel_hash(channel)
+        since = float('-inf') if since is None else since
+        until = float('inf') if until is None else until
+        # The segments are listed with the active segment, so a rotation cannot make an unsorted index look sealed.
+        with self.__lock:
+            numbers = self.__segment_numbers()
+            active_number, active_index = self.__number, self.__index
+            active_range = active_index.scan_range(key, since, until) if active_index is not None else None
+        entries = []
+        for number in numbers:
+            if number == active_number:
+                scan_range = active_range
+            else:
+                scan_range = self.__sealed_range(number, key, since, until)
+            if scan_range is None:
+                continue
+            self.__scan(self.__path(number, '.log'), scan_range, channel.encode('utf-8'), since, until, entries)
+        return entries[-limit:] if limit is not None else entries
+
+    def messages(self, channel, since=None, until=None, limit=None):
+        """
+        Reads the logged messages of `channel`, parsed into `IRCMessage`s; see `ChatLog.read`.
+
+        Returns
+        -------
+        list:
+            The messages, oldest first.
+        """
+        return [IRCMessage(line.decode('utf-8', 'replace'), raw_bytes=line)
+                for _, line in self.read(channel, since=since, until=until, limit=limit)]
+
+    def __path(self, number, extension):
+        return os.path.join(self.__directory, f'{number:08d}{extension}')
+
+    def __segment_numbers(self):
+        if not os.path.isdir(self.__directory):
+            return []
+        return sorted(int(match.group(1)) for match in map(_SEGMENT_NAME.match, os.listdir(self.__directory))
+                      if match is not None)
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__stopping or self.__flushing
+                                          or self.__pending_size >= self.__batch_size, self.__flush_interval)
+                batch, self.__pending, self.__pending_size = self.__pending, [], 0
+                self.__flushing = False
+                stopping = self.__stopping
+            if batch:
+                self.__write(batch)
+            if self.__fsync_interval is not None and time.monotonic() - self.__last_sync >= self.__fsync_interval:
+                self.__sync()
+            with self.__condition:
+                self.__written += len(batch)
+                self.__condition.notify_all()
+            if stopping:
+                with self.__condition:
+                    if not self.__pending:
+                        return
+
+    def __write(self, batch):
+        """Writes a batch of records, rotating the segment whenever it is full."""
+        records, entries = [], []
+        index = self.__index
+        for timestamp, channel, line in batch:
+            record = b'%.6f\t%s\t%s\n' % (timestamp, channel.encode('utf-8'), line.replace(b'\n', b' '))
+            if self.__size and self.__size + len(record) > self.__segment_size:
+                self.__append(records, entries)
+                records, entries = [], []
+                self.__rotate()
+                index = self.__index
+            key = channel_hash(channel)
+            # Entry times only increase per channel, so the entries of a channel can be binary searched by time.
+            latest = index.latest[key] = max(timestamp, index.latest.get(key, timestamp))
+            last_offset = index.last_offsets.get(key)
+            if last_offset is None or self.__size - last_offset >= self.__index_interval:
+                index.last_offsets[key] = self.__size
+                entries.append((key, latest, self.__size, index.span_lows.pop(key, float('inf'))))
+            index.span_lows[key] = min(timestamp, index.span_lows.get(key, timestamp))
+            records.append(record)
+            self.__size += len(record)
+        self.__append(records, entries)
+
+    def __append(self, records, entries):
+        """Writes records and index entries to the current segment, then publishes the entries to readers."""
+        if not records:
+            return
+        self.__log_file.write(b''.join(records))
+        if entries:
+            self.__index_file.write(b''.join(INDEX_ENTRY.pack(*entry) for entry in entries))
+        with self.__lock:
+            index = self.__index
+            for key, latest, offset, low in entries:
+                index.times.setdefault(key, []).append(latest)
+                index.offsets.setdefault(key, []).append(offset)
+                index.lows.setdefault(key, []).append(low)
+        if self.__fsync_interval == 0:
+            self.__sync()
+
+    def __sync(self):
+        os.fsync(self.__log_file.fileno())
+        os.fsync(self.__index_file.fileno())
+        self.__last_sync = time.monotonic()
+
+    def __open_segment(self, number):
+        self.__log_file = open(self.__path(number, '.log'), 'ab', buffering=0)
+        self.__index_file = open(self.__path(number, '.idx'), 'ab', buffering=0)
+        self.__size = self.__log_file.tell()
+        with self.__lock:
+            self.__number = number
+            self.__index = _ActiveIndex()
+        self.__last_sync = time.monotonic()
+
+    def __close_segment(self):
+        number = self.__number
+        # A final entry for each channel bounds the records after its last entry, so reads can stop before them.
+        index = self.__index
+        self.__index_file.write(b''.join(INDEX_ENTRY.pack(key, index.latest[key], self.__size, low)
+                                         for key, low in index.span_lows.items()))
+        self.__sync()
+        self.__log_file.close()
+        self.__index_file.close()
+        self.__seal(number)
+        with self.__lock:
+            self.__number = None
+            self.__index = None
+
+    def __rotate(self):
+        number = self.__number
+        self.__close_segment()
+        self.__open_segment(number + 1)
+
+    def __seal(self, number):
+        """Sorts the index of a segment by channel and time, replacing it atomically."""
+        path = self.__path(number, '.idx')
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            data = b''
+        # A partially written entry is dropped.
+        data = data[:len(data) - len(data) % INDEX_ENTRY.size]
+        entries = sorted(INDEX_ENTRY.iter_unpack(data))
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(b''.join(INDEX_ENTRY.pack(*entry) for entry in entries))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+
+    def __sealed_range(self, number, key, since, until):
+        try:
+            with open(self.__path(number, '.idx'), 'rb') as file:
+                if os.fstat(file.fileno()).st_size < INDEX_ENTRY.size:
+                    return None
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    entries = _SealedIndex(buffer).entries(key)
+            size = os.path.getsize(self.__path(number, '.log'))
+        except FileNotFoundError:
+            return None
+        if not entries:
+            return None
+        times, offsets, lows = zip(*entries)
+        # A segment which was not closed, e.g. because the process was killed, has no final entries.
+        return _scan_range(times, offsets, lows, since, until, complete=offsets[-1] >= size)
+
+    @staticmethod
+    def __scan(path, scan_range, channel, since, until, entries):
+        """
+        Reads the records of a channel in `scan_range` of a segment into `entries`; see `_scan_range`.
+
+        Server-time timestamps are not necessarily in order, so a record after `until` does not end the scan.
+        """
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        with file:
+            offset, size = scan_range[0], os.fstat(file.fileno()).st_size
+            if scan_range[1] is not None:
+                size = min(size, scan_range[1])
+            if offset >= size:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                position = offset
+                while position < size:
+                    end = buffer.find(b'\n', position, size)
+                    if end < 0:
+                        break
+                    timestamp, record_channel, line = buffer[position:end].split(b'\t', 2)
+                    position = end + 1
+                    if record_channel != channel:
+                        continue
+                    timestamp = float(timestamp)
+                    if since <= timestamp <= until:
+                        entries.append((timestamp, line))
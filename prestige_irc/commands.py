@@ -7,13 +7,18 @@ class Commands:
     """
 
     ADMIN = 'ADMIN'
+    AUTHENTICATE = 'AUTHENTICATE'
     AWAY = 'AWAY'
+    BATCH = 'BATCH'
+    CAP = 'CAP'
+    CHATHISTORY = 'CHATHISTORY'
     CNOTICE = 'CNOTICE'
     CPRIVMSG = 'CPRIVMSG'
     CONNECT = 'CONNECT'
     DIE = 'DIE'
     ENCAP = 'ENCAP'
     ERROR = 'ERROR'
+    FAIL = 'FAIL'
     HELP = 'HELP'
     INFO = 'INFO'
     INVITE = 'INVITE'
@@ -26,6 +31,7 @@ class Commands:
     LIST = 'LIST'
     LUSERS = 'LUSERS'
     MODE = 'MODE'
+    MONITOR = 'MONITOR'
     MOTD = 'MOTD'
     NAMES = 'NAMES'
     NAMESX = 'NAMESX'
@@ -1,5 +1,114 @@
+import errno
+import selectors
 import socket
+import ssl
 import threading
+import time
+
+
+def open_connection(host, port, timeout=None, attempt_delay=0.25):
+    """Opens a TCP connection to a host, trying each of its addresses in parallel (RFC 8305, "happy eyeballs").
+
+    Every IPv4 and IPv6 address of `host` is resolved, and the addresses are tried in the order the resolver prefers,
+    alternating between address families. A new attempt is started every `attempt_delay` seconds, or as soon as
+    the previous attempt fails, without cancelling the attempts in progress.
+    The first attempt to succeed is kept, and the others are closed, so a dead server or a broken IPv6 route
+    only delays the connection by `attempt_delay`.
+
+    Parameters
+    ----------
+    host: str
+        The host name or IP address of the server.
+    port: int
+        The port number to connect to.
+    timeout: float|None (optional)
+        The number of seconds to wait for any attempt to succeed. The returned socket uses this timeout as well.
+        Default value is None, which waits until every attempt has failed.
+    attempt_delay: float (optional)
+        The number of seconds to wait for an attempt before starting the next one.
+        Default value is 0.25, as recommended by RFC 8305.
+
+    Returns
+    -------
+    socket.socket:
+        The connected socket.
+
+    Throws
+    ------
+    socket.error:
+        If the host could not be resolved, or no address could be connected to.
+    socket.timeout:
+        If no attempt succeeded within `timeout`.
+    """
+    addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    # Interleave the address families, starting with the family the resolver prefers.
+    by_family = {}
+    for address in addresses:
+        by_family.setdefault(address[0], []).append(address)
+    queues = list(by_family.values())
+    ordered = [queue[i] for i in range(max(map(len, queues), default=0)) for queue in queues if i < len(queue)]
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    selector = selectors.DefaultSelector()
+    attempts = []
+    error = socket.error(f'Could not resolve any address of {host}.')
+    next_attempt = time.monotonic()
+    try:
+        while ordered or attempts:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                raise socket.timeout(f'Timed out connecting to {host}.')
+
+            if ordered and (now >= next_attempt or not attempts):
+                family, sock_type, proto, _, address = ordered.pop(0)
+                next_attempt = now + attempt_delay
+                # An attempt which fails at once, e.g. with EAFNOSUPPORT on a host without IPv6,
+                # is followed by the next attempt right away.
+                try:
+                    sock = socket.socket(family, sock_type, proto)
+                except socket.error as err:
+                    error, next_attempt = err, now
+                    continue
+                sock.setblocking(False)
+                try:
+                    sock.connect(address)
+                except BlockingIOError:
+                    # The connection is in progress (EINPROGRESS, or WSAEWOULDBLOCK on Windows).
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    attempts.append(sock)
+                except socket.error as err:
+                    error, next_attempt = err, now
+                    sock.close()
+                else:
+                    return _connected(sock, timeout)
+                continue
+
+            wait = next_attempt - now if ordered else None
+            if deadline is not None:
+                wait = deadline - now if wait is None else min(wait, deadline - now)
+            for key, _ in selector.select(wait):
+                sock = key.fileobj
+                selector.unregister(sock)
+                attempts.remove(sock)
+                result = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if result == 0:
+                    return _connected(sock, timeout)
+                error = socket.error(result, f'{errno.errorcode.get(result, result)} connecting to {host}')
+                sock.close()
+                # Start the next attempt right away, rather than waiting for the delay.
+                next_attempt = time.monotonic()
+        raise error
+    finally:
+        for sock in attempts:
+            sock.close()
+        selector.close()
+
+
+def _connected(sock, timeout):
+    """Restores a connected, non-blocking socket to blocking mode with `timeout`."""
+    sock.setblocking(True)
+    sock.settimeout(timeout)
+    return sock
 
 
 class Connection(object):
@@ -16,14 +125,19 @@ class Connection(object):
         self.__is_connection_alive = False
         self.__listen_thread = None
         self.__listeners = set()
+        self.__processors = []
+        self.__listener_monitor = None
+        self.__send_lock = threading.Lock()
 
     def connect(self, ip_address, port, timeout=None):
         """Connect to a server.
 
+        Every address of the server is tried in parallel; see `open_connection`.
+
         Parameters
         ----------
         ip_address: str
-            The IP address of the server.
+            The IP address, or host name, of the server.
         port: int
             The port number to bind to.
         timeout: int|None
@@ -34,15 +148,16 @@ class Connection(object):
         -------
         bool:
             If the connection was successfully established.
-
-        Throws
-        ------
-        socket.error:
-            If a connection could not be made.
         """
-        sock = socket.socket()
-        sock.settimeout(timeout)
-        return self.connect_socket(sock=sock, ip_address=ip_address, port=port)
+        if self.__is_connection_alive:
+            return False
+        try:
+            sock = open_connection(host=ip_address, port=port, timeout=timeout)
+        except socket.error as err:
+            print(f'Caught exception socket.error:\n{str(err)}')
+            return False
+        sock.settimeout(None)
+        return self.attach_socket(sock=sock)
 
     def connect_socket(self, sock, ip_address, port):
         """Connect to a server using the given socket.
@@ -60,25 +175,39 @@ class Connection(object):
         -------
         bool:
             If the connection was successfully established.
-
-        Throws
-        ------
-        socket.error:
-            If a connection could not be made.
         """
-        if not self.__is_connection_alive:
-            try:
-                self.__socket = sock
-                self.__socket.connect((ip_address, port))
-                self.__is_connection_alive = True
-                self.__listen_thread = threading.Thread(target=self.__listen)
-                self.__listen_thread.start()
-            except socket.error as err:
-                print(f'Caught exception socket.error:\n{str(err)}')
-                self.__is_connection_alive = False
-            return self.__is_connection_alive
+        if self.__is_connection_alive:
+            return False
+        try:
+            sock.connect((ip_address, port))
+        except socket.error as err:
+            print(f'Caught exception socket.error:\n{str(err)}')
+            return False
+        return self.attach_socket(sock=sock)
 
-        return False
+    def attach_socket(self, sock):
+        """Starts using a socket which is already connected to a server.
+
+        Both Connection.connect and Connection.connect_socket end by calling this method.
+
+        Parameters
+        ----------
+        sock: socket.py
+            The connected socket.
+
+        Returns
+        -------
+        bool:
+            If the connection was successfully established;
+            False if this connection is already connected.
+        """
+        if self.__is_connection_alive:
+            return False
+        self.__socket = sock
+        self.__is_connection_alive = True
+        self.__listen_thread = threading.Thread(target=self.__listen)
+        self.__listen_thread.start()
+        return True
 
     def disconnect(self):
         """Disconnects from the server.
@@ -89,8 +218,13 @@ class Connection(object):
            If the connection was successfully terminated.
         """
         if self.__is_connection_alive:
-            self.__socket.close()
             self.__is_connection_alive = False
+            try:
+                # Wakes up the listen thread if it is blocked waiting for data.
+                self.__socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.__socket.close()
             return True
         return False
 
@@ -105,6 +239,19 @@ class Connection(object):
         """
         return self.__is_connection_alive
 
+    @property
+    def local_address(self):
+        """Gets the local IP address of the connection, e.g. to tell a peer where to connect for DCC.
+
+        Returns
+        -------
+        str|None:
+            The IP address, or None if the connection is not connected.
+        """
+        if not self.__is_connection_alive:
+            return None
+        return self.__socket.getsockname()[0]
+
     def send_data(self, data):
         """Sends bytes across the connection.
 
@@ -113,7 +260,42 @@ class Connection(object):
         data: bytes
             The bytes to send.
         """
-        self.__socket.send(data)
+        # Sent in full while holding the lock, so data sent from different threads is never interleaved.
+        with self.__send_lock:
+            self.__socket.sendall(data)
+
+    def send_buffers(self, buffers):
+        """Sends several bytes-like objects across the connection as one, without joining them first.
+
+        The buffers are written with a single scatter-gather `sendmsg` where the socket supports it;
+        TLS sockets do not, so the buffers are joined and sent with `sendall` instead.
+
+        Parameters
+        ----------
+        buffers: list
+            The bytes-like objects to send, e.g. `memoryview` slices of received data.
+
+        Returns
+        -------
+        bool:
+            If the buffers were sent; False if the connection is not connected.
+        """
+        sock = self.__socket
+        if not self.__is_connection_alive or sock is None:
+            return False
+        with self.__send_lock:
+            if not hasattr(sock, 'sendmsg') or isinstance(sock, ssl.SSLSocket):
+                sock.sendall(b''.join(buffers))
+                return True
+            buffers = [memoryview(buffer).cast('B') for buffer in buffers]
+            while buffers:
+                sent = sock.sendmsg(buffers)
+                # Drop the buffers which were sent in full, and the sent part of the first one which was not.
+                while buffers and sent >= len(buffers[0]):
+                    sent -= len(buffers.pop(0))
+                if sent:
+                    buffers[0] = buffers[0][sent:]
+        return True
 
     def send(self, message, crlf_ending=True):
         """Helper function; sends a string across the connection as bytes.
@@ -150,6 +332,45 @@ class Connection(object):
         """
         self.__listeners.remove(listener)
 
+    def set_listener_monitor(self, monitor):
+        """Sets the monitor through which listeners are called, e.g. to time them.
+
+        Parameters
+        ----------
+        monitor: ListenerMonitor|None
+            An object with a `run(connection, listener, message)` method, which is called for each listener
+            instead of calling the listener directly, or None to call listeners directly.
+        """
+        self.__listener_monitor = monitor
+
+    def add_processor(self, processor):
+        """Adds a processor to the connection.
+
+        Processors are called in the order they were added, on the thread which receives data,
+        with each object created by Connection._process_data(bytes) before it is dispatched to the listeners.
+        Unlike listeners, processors see objects in the order they were received, so they suit keeping state;
+        they should return quickly, since no data is received while they run.
+
+        Parameters
+        ----------
+        processor: (Connection, object) -> object|None
+            A function which accepts the connection and an object, and returns the object to pass on to the next
+            processor and then the listeners, which may be a different object.
+            If it returns None, the object is not passed on.
+            If it raises an exception, the exception is printed and the object is passed on unchanged.
+        """
+        self.__processors.append(processor)
+
+    def remove_processor(self, processor):
+        """Removes a processor from the connection.
+
+        Parameters
+        ----------
+        processor: (Connection, object) -> object|None
+            A processor previously added with Connection.add_processor.
+        """
+        self.__processors.remove(processor)
+
     def _process_data(self, data):
         """Processes the bytes received by the server.
 
@@ -165,6 +386,32 @@ class Connection(object):
         """
         return data
 
+    def __handle(self, data):
+        """Creates an object from the bytes received, runs the processors over it and dispatches the listeners.
+
+        Parameters
+        ----------
+        data: bytes
+            The bytes of a message received from the server.
+        """
+        # An exception would end the listen thread, and with it the connection, so it only costs this message,
+        # or the processor which raised it.
+        try:
+            obj = self._process_data(data)
+        except Exception as err:
+            print(f'Caught exception processing received data:\n{str(err)}')
+            return
+        for processor in list(self.__processors):
+            try:
+                processed = processor(self, obj)
+            except Exception as err:
+                print(f'Caught exception in processor:\n{str(err)}')
+                continue
+            if processed is None:
+                return
+            obj = processed
+        self.__dispatch_listeners(obj)
+
     def __dispatch_listeners(self, obj):
         """Dispatches the listeners waiting for the object.
 
@@ -174,8 +421,11 @@ class Connection(object):
             The object to send to the listeners.
         """
         def notify():
-            for listener in self.__listeners:
-                if listener.accept(connection=self, message=obj):
+            monitor = self.__listener_monitor
+            for listener in list(self.__listeners):
+                if monitor is not None:
+                    monitor.run(connection=self, listener=listener, message=obj)
+                elif listener.accept(connection=self, message=obj):
                     listener.receive(connection=self, message=obj)
         threading.Thread(target=notify).start()
 
@@ -191,28 +441,21 @@ class Connection(object):
 
         trailing = b''
         while self.__is_connection_alive:
-            data = self.__socket.recv(buffer_size)
+            try:
+                data = self.__socket.recv(buffer_size)
+            except socket.error:
+                # The socket was closed or reset; treat it the same as the server terminating the connection.
+                data = b''
             if data:
 
-                # Handle messages which are only CRLFs.
-                if data == b'\r\n':
-                    self.__dispatch_listeners(self._process_data(trailing))
-                    trailing = b''
-
-                # Messages are separated by CR-LF. Last element is removed since it will be empty.
-                split = data.split(b'\r\n')
-                trailing += split.pop()
-
-                # Ensure trailing information is added to the start of the next message.
-                msg_count = len(split)
-                if msg_count > 0:
-                    split[0] = trailing + split[0]
-                    trailing = b''
+                # Messages are separated by CR-LF. The incomplete message received before this data is its start,
+                # and the last element is the start of the next message, which is empty if the data ends with CR-LF.
+                split = (trailing + data).split(b'\r\n')
+                trailing = split.pop()
 
-                for i in range(msg_count):
-                    msg = split[i]
+                for msg in split:
                     if msg:
-                        self.__dispatch_listeners(self._process_data(msg))
+                        self.__handle(msg)
             else:
                 # Connection terminated by server: data was empty.
                 self.__is_connection_alive = False
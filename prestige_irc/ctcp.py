@@ -0,0 +1,130 @@
+import threading
+import time
+
+from prestige_irc.commands import Commands
+from prestige_irc.connection import MessageListener
+
+
+def format_ctcp(command, params=''):
+    """
+    Encodes a CTCP payload, to be sent as the text of a PRIVMSG (a request) or NOTICE (a reply).
+
+    Parameters
+    ----------
+    command: str
+        The CTCP command, e.g. 'VERSION'.
+    params: str (optional)
+        The parameters of the command.
+        Default value is an empty string.
+
+    Returns
+    -------
+    str:
+        The payload, delimited with `\\x01`.
+    """
+    return f'\x01{command} {params}\x01' if params else f'\x01{command}\x01'
+
+
+class TokenBucket(object):
+
+    """A token bucket rate limiter: allows bursts of `burst` events, refilled at `rate` events per second."""
+
+    def __init__(self, rate, burst):
+        """
+        Creates a full bucket.
+
+        Parameters
+        ----------
+        rate: float
+            The number of events allowed per second, on average.
+        burst: int
+            The number of events allowed at once.
+        """
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = float(burst)
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def consume(self):
+        """
+        Takes a token from the bucket, if there is one.
+
+        Returns
+        -------
+        bool:
+            If the event is allowed.
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.__burst, self.__tokens + (now - self.__updated) * self.__rate)
+            self.__updated = now
+            if self.__tokens < 1:
+                return False
+            self.__tokens -= 1
+            return True
+
+
+class CTCPResponder(MessageListener):
+
+    """
+    A listener which answers CTCP VERSION, PING, TIME and CLIENTINFO requests sent with PRIVMSG.
+
+    Replies are rate limited, both overall and per sender, so a flood of CTCP requests (a common way to get a client
+    disconnected for excess flood) is mostly ignored rather than answered.
+    """
+
+    def __init__(self, version='prestige_irc', rate=0.5, burst=4, sender_interval=5.0, max_senders=1024):
+        """
+        Creates the responder; add it with `Connection.add_listener`.
+
+        Parameters
+        ----------
+        version: str (optional)
+            The reply to VERSION requests.
+            Default value is 'prestige_irc'.
+        rate: float (optional)
+            The number of replies sent per second, on average, to all senders together.
+            Default value is 0.5.
+        burst: int (optional)
+            The number of replies which can be sent at once, to all senders together.
+            Default value is 4.
+        sender_interval: float (optional)
+            The minimum number of seconds between two replies to the same host.
+            Default value is 5.0.
+        max_senders: int (optional)
+            The maximum number of hosts whose last reply time is remembered.
+            Default value is 1024.
+        """
+        super().__init__(receive=self.__reply, message_filter=self.__is_request)
+        self.__replies = {
+            'VERSION': lambda params: version,
+            'PING': lambda params: params,
+            'TIME': lambda params: time.strftime('%a %b %d %H:%M:%S %Y'),
+            'CLIENTINFO': lambda params: 'CLIENTINFO PING TIME VERSION',
+        }
+        self.__bucket = TokenBucket(rate=rate, burst=burst)
+        self.__sender_interval = sender_interval
+        self.__max_senders = max_senders
+        # The time of the last reply to each host.
+        self.__last_replies = {}
+        self.__lock = threading.Lock()
+
+    def __is_request(self, connection, message):
+        ctcp = message.ctcp
+        return message.command == Commands.PRIVMSG and ctcp is not None and ctcp[0] in self.__replies
+
+    def __reply(self, connection, message):
+        now = time.monotonic()
+        with self.__lock:
+            last = self.__last_replies.get(message.host)
+            if last is not None and now - last < self.__sender_interval:
+                return
+            if len(self.__last_replies) >= self.__max_senders:
+                self.__last_replies = {host: replied for host, replied in self.__last_replies.items()
+                                       if now - replied < self.__sender_interval}
+            self.__last_replies[message.host] = now
+        if not self.__bucket.consume():
+            return
+        command, params = message.ctcp
+        connection.cmd_notice(target=message.nick, message=format_ctcp(command, self.__replies[command](params)))
@@ -0,0 +1,319 @@
+import ipaddress
+import mmap
+import os
+import socket
+import struct
+import threading
+
+from prestige_irc.ctcp import format_ctcp
+
+# The acknowledgement a receiver sends after each chunk: the number of bytes received so far, modulo 2^32.
+ACK = struct.Struct('!I')
+
+
+class DCCOffer(object):
+
+    """A DCC SEND offer received from another user."""
+
+    def __init__(self, nick, filename, host, port, size):
+        """
+        Parameters
+        ----------
+        nick: str
+            The nick of the user offering the file.
+        filename: str
+            The name of the file, without any directories.
+        host: str
+            The IP address to connect to.
+        port: int
+            The port to connect to.
+        size: int|None
+            The size of the file in bytes, or None if the sender did not send it.
+        """
+        self.nick = nick
+        self.filename = filename
+        self.host = host
+        self.port = port
+        self.size = size
+
+    @classmethod
+    def from_message(cls, message):
+        """
+        Decodes a DCC SEND offer, e.g. `\\x01DCC SEND "file name.txt" 3232235777 5000 1234\\x01`.
+
+        Parameters
+        ----------
+        message: IRCMessage
+            A received message.
+
+        Returns
+        -------
+        DCCOffer|None:
+            The offer, or None if the message is not a DCC SEND offer which can be connected to.
+            Reverse (passive) offers, with port 0, are not supported.
+        """
+        ctcp = message.ctcp
+        if ctcp is None or ctcp[0] != 'DCC' or not ctcp[1].upper().startswith('SEND '):
+            return None
+        rest = ctcp[1][5:].lstrip()
+        if rest.startswith('"'):
+            filename, _, rest = rest[1:].partition('"')
+            fields = rest.split()
+        else:
+            filename, *fields = rest.split()
+        if len(fields) < 2 or not fields[1].isdigit() or int(fields[1]) == 0:
+            return None
+        try:
+            host = str(ipaddress.ip_address(int(fields[0]) if fields[0].isdigit() else fields[0]))
+        except ValueError:
+            return None
+        size = int(fields[2]) if len(fields) > 2 and fields[2].isdigit() else None
+        # The name is only used as a name: directories could be used to write outside of the download directory.
+        filename = os.path.basename(filename.replace('\\', '/')) or 'unnamed'
+        return cls(nick=message.nick, filename=filename, host=host, port=int(fields[1]), size=size)
+
+
+class _Transfer(object):
+
+    """The state of a file transfer running in a background thread."""
+
+    def __init__(self):
+        self._transferred = 0
+        self._error = None
+        self._done = threading.Event()
+        self._thread = None
+
+    @property
+    def transferred(self):
+        """
+        Returns
+        -------
+        int:
+            The number of bytes transferred so far.
+        """
+        return self._transferred
+
+    @property
+    def error(self):
+        """
+        Returns
+        -------
+        Exception|None:
+            The error which ended the transfer, or None if it has not failed.
+        """
+        return self._error
+
+    @property
+    def done(self):
+        """
+        Returns
+        -------
+        bool:
+            If the transfer has finished, successfully or not.
+        """
+        return self._done.is_set()
+
+    def join(self, timeout=None):
+        """
+        Waits for the transfer to finish.
+
+        Parameters
+        ----------
+        timeout: float (optional)
+            The maximum number of seconds to wait.
+            Default value is None, which waits indefinitely.
+
+        Returns
+        -------
+        bool:
+            If the transfer finished successfully before the timeout.
+        """
+        return self._done.wait(timeout) and self._error is None
+
+    def _start(self, target):
+        self._thread = threading.Thread(target=self._run, args=(target,), daemon=True)
+        self._thread.start()
+
+    def _run(self, target):
+        try:
+            target()
+        except (OSError, ValueError) as err:
+            self._error = err
+        finally:
+            self._done.set()
+
+
+class DCCSend(_Transfer):
+
+    """
+    Offers a file to a user with DCC SEND, and sends it once the user connects.
+
+    The file is sent with `socket.sendfile`, so the kernel copies it straight from the page cache to the socket
+    without it passing through Python.
+    """
+
+    def __init__(self, connection, nick, path, address=None, port=0, timeout=120):
+        """
+        Readies the offer; call `start` to send it.
+
+        Parameters
+        ----------
+        connection: IRCConnection
+            The connection to send the offer over.
+        nick: str
+            The nick of the user to send the file to.
+        path: str
+            The path of the file to send.
+        address: str (optional)
+            The IP address the user should connect to, e.g. the external address of a host behind NAT.
+            Default value is None, which uses the local address of `connection`.
+        port: int (optional)
+            The port to listen on.
+            Default value is 0, which uses any free port.
+        timeout: float (optional)
+            The number of seconds to wait for the user to connect, and then for each acknowledgement.
+            Default value is 120.
+        """
+        super().__init__()
+        self.__connection = connection
+        self.__nick = nick
+        self.__path = path
+        self.__address = address
+        self.__port = port
+        self.__timeout = timeout
+        self.__size = os.path.getsize(path)
+
+    @property
+    def size(self):
+        """
+        Returns
+        -------
+        int:
+            The size of the file in bytes.
+        """
+        return self.__size
+
+    def start(self):
+        """Listens for the user, sends the offer, and sends the file in a background thread once the user connects."""
+        address = ipaddress.ip_address(self.__address or self.__connection.local_address)
+        server = socket.create_server(('', self.__port), family=socket.AF_INET6 if address.version == 6
+                                      else socket.AF_INET)
+        server.settimeout(self.__timeout)
+        port = server.getsockname()[1]
+        # IPv4 addresses are sent as an integer, for compatibility with old clients.
+        host = int(address) if address.version == 4 else str(address)
+        filename = os.path.basename(self.__path)
+        if ' ' in filename:
+            filename = f'"{filename}"'
+        self.__connection.cmd_privmsg(target=self.__nick,
+                                      message=format_ctcp('DCC', f'SEND {filename} {host} {port} {self.__size}'))
+        self._start(lambda: self.__send(server))
+
+    def __send(self, server):
+        with server:
+            peer, _ = server.accept()
+        with peer, open(self.__path, 'rb') as file:
+            peer.settimeout(self.__timeout)
+            self._transferred = peer.sendfile(file)
+            # The transfer is complete once the receiver acknowledges the last byte.
+            expected = self.__size & 0xFFFFFFFF
+            pending = b''
+            while True:
+                data = peer.recv(1024)
+                if not data:
+                    break
+                pending += data
+                complete = len(pending) - len(pending) % ACK.size
+                if complete and ACK.unpack_from(pending, complete - ACK.size)[0] == expected:
+                    break
+                pending = pending[complete:]
+
+
+class DCCReceive(_Transfer):
+
+    """
+    Receives a file offered with DCC SEND.
+
+    When the size of the file is known, the output file is created at its full size and memory-mapped,
+    and the data is received straight into the mapping with `socket.recv_into`, without intermediate buffers.
+    """
+
+    def __init__(self, offer, path, chunk_size=65536, timeout=60, max_size=1024 * 1024 * 1024):
+        """
+        Readies the transfer; call `start` to connect to the sender.
+
+        Parameters
+        ----------
+        offer: DCCOffer
+            The offer to accept.
+        path: str
+            The path to write the file to.
+        chunk_size: int (optional)
+            The maximum number of bytes received at once.
+            Default value is 65536.
+        timeout: float (optional)
+            The number of seconds to wait to connect, and then for each chunk.
+            Default value is 60.
+        max_size: int|None (optional)
+            The largest file accepted, in bytes. The size comes from the sender, so offers of larger files are
+            rejected before the output file is created, and a file of unknown size is cut off at this size.
+            Default value is 1 GiB; None accepts any size.
+        """
+        super().__init__()
+        self.__offer = offer
+        self.__path = path
+        self.__chunk_size = chunk_size
+        self.__timeout = timeout
+        self.__max_size = max_size
+
+    def start(self):
+        """
+        Connects to the sender, and receives the file in a background thread.
+
+        Throws
+        ------
+        ValueError:
+            If the offered file is larger than `max_size`.
+        """
+        if self.__max_size is not None and self.__offer.size is not None and self.__offer.size > self.__max_size:
+            raise ValueError(f'The offered file of {self.__offer.size} bytes is larger than {self.__max_size} bytes.')
+        self._start(self.__receive)
+
+    def __receive(self):
+        size = self.__offer.size
+        with socket.create_connection((self.__offer.host, self.__offer.port), timeout=self.__timeout) as peer, \
+                open(self.__path, 'w+b') as file:
+            if size is None:
+                self.__receive_unsized(peer, file)
+                return
+            file.truncate(size)
+            if size == 0:
+                return
+            with mmap.mmap(file.fileno(), size) as mapping:
+                view = memoryview(mapping)
+                try:
+                    while self._transferred < size:
+                        received = peer.recv_into(view[self._transferred:self._transferred + self.__chunk_size])
+                        if not received:
+                            break
+                        self._transferred += received
+                        peer.sendall(ACK.pack(self._transferred & 0xFFFFFFFF))
+                finally:
+                    view.release()
+                mapping.flush()
+            if self._transferred < size:
+                raise ValueError(f'The connection closed after {self._transferred} of {size} bytes.')
+
+    def __receive_unsized(self, peer, file):
+        """Receives a file of unknown size until the sender closes the connection."""
+        buffer = bytearray(self.__chunk_size)
+        view = memoryview(buffer)
+        while True:
+            received = peer.recv_into(buffer)
+            if not received:
+                break
+            if self.__max_size is not None and self._transferred + received > self.__max_size:
+                raise ValueError(f'The file is larger than {self.__max_size} bytes.')
+            file.write(view[:received])
+            self._transferred += received
+            peer.sendall(ACK.pack(self._transferred & 0xFFFFFFFF))
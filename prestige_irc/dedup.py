@@ -0,0 +1,151 @@
+import collections
+import hashlib
+import threading
+import time
+
+from prestige_irc.commands import Commands
+from prestige_irc.message import IRCBatch
+
+# The commands which are relayed to every connection in the same way, and so are received once by each of them.
+# Replies to a connection's own commands, and PINGs, which each connection must answer, are never deduplicated.
+DEFAULT_COMMANDS = (Commands.PRIVMSG, Commands.NOTICE, Commands.JOIN, Commands.PART, Commands.KICK, Commands.QUIT,
+                    Commands.NICK, Commands.TOPIC, Commands.MODE, Commands.INVITE)
+
+# The types of the batches sent in reply to a connection's own commands, which are never deduplicated.
+_REPLY_BATCH_TYPES = ('chathistory', 'draft/chathistory', 'labeled-response')
+
+
+class _Seen(object):
+
+    """The occurrences of a message which have been received over each connection."""
+
+    def __init__(self, expires):
+        self.expires = expires
+        self.counts = {}
+        self.delivered = 0
+
+
+class Deduplicator(object):
+
+    """
+    A processor which drops the messages another connection has already received,
+    for redundant connections to the same network; add the same instance to each of them with
+    `Connection.add_processor`.
+
+    Messages are identified by their IRCv3 `msgid` tag. Without one, they are identified by a hash of the message
+    without its tags but with its `time` tag, and only within a short window, since the same user may legitimately
+    send the same line twice. Batches, such as netsplits, are identified by the `msgid` of the line which opened
+    them, or else by a hash of their type, parameters and the identifiers of their messages, since their reference
+    differs on each connection. Occurrences are counted per connection, so a line which is sent twice is delivered twice
+    even when both connections receive it.
+    The identifiers are kept in a bounded, time-expiring LRU.
+    """
+
+    def __init__(self, ttl=60, window=5, max_entries=100000, commands=DEFAULT_COMMANDS):
+        """
+        Creates the deduplicator.
+
+        Parameters
+        ----------
+        ttl: float (optional)
+            The number of seconds a `msgid` is remembered.
+            Default value is 60.
+        window: float (optional)
+            The number of seconds a message without a `msgid` is remembered.
+            Default value is 5.
+        max_entries: int (optional)
+            The maximum number of messages remembered; the least recently seen are forgotten first.
+            Default value is 100000.
+        commands: collections.iterable (optional)
+            The commands of the messages which are deduplicated.
+            Default value is `DEFAULT_COMMANDS`.
+        """
+        self.__ttl = ttl
+        self.__window = window
+        self.__max_entries = max_entries
+        self.__commands = frozenset(commands)
+        # Maps each message identifier to its `_Seen`, least recently seen first.
+        self.__seen = collections.OrderedDict()
+        self.__dropped = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def dropped(self):
+        """
+        Returns
+        -------
+        int:
+            The number of duplicate messages which have been dropped.
+        """
+        return self.__dropped
+
+    def __len__(self):
+        return len(self.__seen)
+
+    def __call__(self, connection, message):
+        """
+        Drops `message` if another connection has already received it.
+
+        Parameters
+        ----------
+        connection: Connection
+            The connection the message was received over.
+        message: IRCMessage
+            The message received.
+
+        Returns
+        -------
+        IRCMessage|None:
+            `message`, or None if it is a duplicate.
+        """
+        if isinstance(message, IRCBatch):
+            if message.type in _REPLY_BATCH_TYPES:
+                return message
+        elif message.command not in self.__commands:
+            return message
+        key, ttl = self.__key(message)
+
+        now = time.monotonic()
+        with self.__lock:
+            seen = self.__seen.get(key)
+            if seen is None or seen.expires <= now:
+                seen = self.__seen[key] = _Seen(now + ttl)
+            self.__seen.move_to_end(key)
+            count = seen.counts[connection] = seen.counts.get(connection, 0) + 1
+            duplicate = count <= seen.delivered
+            if duplicate:
+                self.__dropped += 1
+            else:
+                seen.delivered = count
+            self.__expire(now)
+        return None if duplicate else message
+
+    def __expire(self, now):
+        """Forgets the expired messages at the front of the LRU, and the oldest ones past `max_entries`."""
+        while self.__seen:
+            seen = next(iter(self.__seen.values()))
+            if seen.expires > now and len(self.__seen) <= self.__max_entries:
+                break
+            self.__seen.popitem(last=False)
+
+    def __key(self, message):
+        """Gets the identifier of a message, and the number of seconds it is remembered."""
+        msgid = message.tags.get('msgid')
+        if msgid:
+            return msgid, self.__ttl
+        if not isinstance(message, IRCBatch):
+            return self.__hash(message), self.__window
+        digest = hashlib.blake2b(' '.join([message.type] + message.params).encode('utf-8'), digest_size=16)
+        ttl = self.__window
+        for inner in message.messages:
+            key, inner_ttl = self.__key(inner)
+            digest.update(b'\0' + (key.encode('utf-8') if isinstance(key, str) else key))
+            ttl = max(ttl, inner_ttl)
+        return digest.digest(), ttl
+
+    @staticmethod
+    def __hash(message):
+        raw = message.encoded
+        if raw[:1] == b'@':
+            raw = raw[raw.find(b' ') + 1:]
+        return hashlib.blake2b(raw + message.tags.get('time', '').encode('utf-8'), digest_size=16).digest()
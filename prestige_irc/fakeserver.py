@@ -0,0 +1,381 @@
+import os
+import selectors
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+
+from prestige_irc.commands import Commands
+from prestige_irc.message import parse_many
+from prestige_irc.replies import Replies
+
+
+def create_self_signed_contexts(host='localhost', directory=None):
+    """
+    Creates a self-signed certificate, and the TLS contexts for a `FakeIRCServer` and the clients connecting to it.
+
+    The certificate is generated with the `openssl` command line tool, which must be installed.
+
+    Parameters
+    ----------
+    host: str (optional)
+        The host name the certificate is issued for, which clients must connect to.
+        Default value is 'localhost'.
+    directory: str (optional)
+        The directory to write the certificate and key to.
+        Default value is None, which uses a new temporary directory.
+
+    Returns
+    -------
+    server_context: ssl.SSLContext
+        The context to pass to `FakeIRCServer`.
+    client_context: ssl.SSLContext
+        A context which trusts the certificate, to pass to `IRCConnection.connect`.
+    """
+    directory = directory if directory is not None else tempfile.mkdtemp(prefix='prestige_irc-')
+    cert_file = os.path.join(directory, 'cert.pem')
+    key_file = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', f'/CN={host}', '-addext', f'subjectAltName=DNS:{host},IP:127.0.0.1',
+                    '-keyout', key_file, '-out', cert_file],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(certfile=cert_file, keyfile=key_file)
+    client_context = ssl.create_default_context(cafile=cert_file)
+    return server_context, client_context
+
+
+class _Client(object):
+
+    """A client connected to a `FakeIRCServer`."""
+
+    def __init__(self, sock, address, handshaking):
+        self.sock = sock
+        self.address = address
+        self.handshaking = handshaking
+        self.input = b''
+        self.output = bytearray()
+        self.nick = None
+        self.user = None
+        self.registered = False
+        self.channels = set()
+
+    @property
+    def prefix(self):
+        return f'{self.nick}!{self.user}@{self.address[0]}'
+
+
+class FakeIRCServer(object):
+
+    """
+    A lightweight, in-process stand-in for an IRC server, for testing and load testing clients without an ircd.
+
+    It speaks enough of the protocol for registration (NICK, USER, PASS, and CAP with no capabilities),
+    JOIN, PART, PRIVMSG, NOTICE, NAMES, PING and QUIT, and serves every client from a single thread.
+    Nicks and channels are compared case-insensitively with ASCII rules.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, ssl_context=None, name='fake.irc'):
+        """
+        Readies the server; call `start` to begin accepting clients.
+
+        Parameters
+        ----------
+        host: str (optional)
+            The address to listen on.
+            Default value is '127.0.0.1'.
+        port: int (optional)
+            The port to listen on.
+            Default value is 0, which picks a free port; see `address`.
+        ssl_context: ssl.SSLContext (optional)
+            The context used to accept TLS connections, e.g. from `create_self_signed_contexts`.
+            Default value is None, which accepts plain connections.
+        name: str (optional)
+            The server name, used as the prefix of the messages the server sends.
+            Default value is 'fake.irc'.
+        """
+        self.__name = name
+        self.__ssl_context = ssl_context
+        self.__listener = socket.create_server((host, port))
+        self.__listener.setblocking(False)
+        self.__selector = selectors.DefaultSelector()
+        self.__clients = {}
+        self.__nicks = {}
+        self.__channels = {}
+        self.__thread = None
+        self.__stopped = threading.Event()
+        self.__messages_received = 0
+        self.__messages_sent = 0
+
+    @property
+    def address(self):
+        """
+        Returns
+        -------
+        tuple:
+            The (host, port) the server is listening on.
+        """
+        return self.__listener.getsockname()[:2]
+
+    @property
+    def messages_received(self):
+        """
+        Returns
+        -------
+        int:
+            The number of messages received from clients.
+        """
+        return self.__messages_received
+
+    @property
+    def messages_sent(self):
+        """
+        Returns
+        -------
+        int:
+            The number of messages sent to clients.
+        """
+        return self.__messages_sent
+
+    def start(self):
+        """Starts serving clients in a background thread."""
+        self.__stopped.clear()
+        self.__selector.register(self.__listener, selectors.EVENT_READ)
+        self.__thread = threading.Thread(target=self.__serve, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Stops the server, and disconnects every client."""
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        for client in list(self.__clients.values()):
+            self.__close(client)
+        self.__selector.close()
+        self.__listener.close()
+
+    def __serve(self):
+        while not self.__stopped.is_set():
+            for key, events in self.__selector.select(timeout=0.1):
+                if key.fileobj is self.__listener:
+                    self.__accept()
+                    continue
+                client = key.data
+                if client.sock.fileno() == -1:
+                    continue
+                try:
+                    if client.handshaking:
+                        self.__handshake(client)
+                    else:
+                        if events & selectors.EVENT_READ:
+                            self.__read(client)
+                        if events & selectors.EVENT_WRITE and client.sock.fileno() != -1:
+                            self.__flush(client)
+                except (ssl.SSLError, socket.error):
+                    self.__close(client)
+
+    def __accept(self):
+        while True:
+            try:
+                sock, address = self.__listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.__ssl_context is not None:
+                sock = self.__ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+            client = _Client(sock, address, handshaking=self.__ssl_context is not None)
+            self.__clients[sock.fileno()] = client
+            self.__selector.register(sock, selectors.EVENT_READ, data=client)
+
+    def __handshake(self, client):
+        try:
+            client.sock.do_handshake()
+            client.handshaking = False
+            self.__selector.modify(client.sock, selectors.EVENT_READ, data=client)
+            # Data sent right after the handshake may already be buffered by the TLS layer.
+            self.__read(client)
+        except ssl.SSLWantReadError:
+            self.__selector.modify(client.sock, selectors.EVENT_READ, data=client)
+        except ssl.SSLWantWriteError:
+            self.__selector.modify(client.sock, selectors.EVENT_WRITE, data=client)
+
+    def __read(self, client):
+        chunks = [client.input]
+        while True:
+            try:
+                data = client.sock.recv(65536)
+            except (ssl.SSLWantReadError, BlockingIOError):
+                break
+            if not data:
+                self.__quit(client, 'Connection closed')
+                return
+            chunks.append(data)
+        messages, client.input = parse_many(b''.join(chunks))
+        for message in messages:
+            self.__messages_received += 1
+            # A line the server cannot handle is dropped, so one bad client never stops the server thread.
+            try:
+                self.__handle(client, message)
+            except (ssl.SSLError, socket.error):
+                raise
+            except Exception as err:
+                print(f'Caught exception handling {message.raw!r}:\n{str(err)}')
+            if client.sock.fileno() == -1:
+                return
+
+    def __send(self, client, line):
+        if client.sock.fileno() == -1:
+            return
+        if not client.output:
+            self.__selector.modify(client.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, data=client)
+        client.output += f'{line}\r\n'.encode('utf-8')
+        self.__messages_sent += 1
+
+    def __flush(self, client):
+        try:
+            sent = client.sock.send(client.output)
+        except (ssl.SSLWantWriteError, BlockingIOError):
+            return
+        del client.output[:sent]
+        if not client.output:
+            self.__selector.modify(client.sock, selectors.EVENT_READ, data=client)
+
+    def __reply(self, client, numeric, params):
+        self.__send(client, f':{self.__name} {numeric} {client.nick or "*"} {params}')
+
+    def __close(self, client):
+        if client.sock.fileno() == -1:
+            return
+        if client.output:
+            try:
+                client.sock.send(client.output)
+            except (ssl.SSLError, socket.error):
+                pass
+        self.__clients.pop(client.sock.fileno(), None)
+        self.__selector.unregister(client.sock)
+        client.sock.close()
+        if client.nick is not None and self.__nicks.get(client.nick.lower()) is client:
+            del self.__nicks[client.nick.lower()]
+        for channel in client.channels:
+            members = self.__channels.get(channel)
+            if members is not None:
+                members.discard(client)
+                if not members:
+                    del self.__channels[channel]
+
+    def __quit(self, client, reason):
+        notified = set()
+        for channel in client.channels:
+            notified.update(self.__channels.get(channel, ()))
+        notified.discard(client)
+        if client.registered:
+            for member in notified:
+                self.__send(member, f':{client.prefix} QUIT :{reason}')
+        self.__close(client)
+
+    def __handle(self, client, message):
+        command = message.command.upper()
+        if command == Commands.CAP:
+            subcommand = message.target.upper()
+            if subcommand == 'LS':
+                self.__send(client, f':{self.__name} CAP {client.nick or "*"} LS :')
+            elif subcommand == 'REQ':
+                self.__send(client, f':{self.__name} CAP {client.nick or "*"} NAK :{message.text}')
+        elif command == Commands.PASS:
+            pass
+        elif command == Commands.NICK:
+            self.__nick(client, message.target)
+        elif command == Commands.USER:
+            client.user = message.target
+            self.__register(client)
+        elif command == Commands.PING:
+            self.__send(client, f':{self.__name} PONG {self.__name} :{message.text}')
+        elif command == Commands.QUIT:
+            self.__quit(client, f'Quit: {message.text}' if message.args else 'Quit')
+        elif not client.registered:
+            self.__reply(client, Replies.ERR_NOTREGISTERED, ':You have not registered')
+        elif command == Commands.JOIN:
+            for channel in message.target.split(','):
+                self.__join(client, channel)
+        elif command == Commands.PART:
+            for channel in message.target.split(','):
+                self.__part(client, channel, message.args[1] if len(message.args) > 1 else '')
+        elif command in (Commands.PRIVMSG, Commands.NOTICE):
+            for target in message.target.split(','):
+                self.__message(client, command, target, message.text)
+        elif command == Commands.NAMES:
+            for channel in message.target.split(','):
+                self.__names(client, channel)
+        else:
+            self.__reply(client, Replies.ERR_UNKNOWNCOMMAND, f'{message.command} :Unknown command')
+
+    def __nick(self, client, nick):
+        owner = self.__nicks.get(nick.lower())
+        if owner is not None and owner is not client:
+            self.__reply(client, Replies.ERR_NICKNAMEINUSE, f'{nick} :Nickname is already in use')
+            return
+        if client.nick is not None:
+            self.__nicks.pop(client.nick.lower(), None)
+            if client.registered:
+                self.__send(client, f':{client.prefix} NICK :{nick}')
+        self.__nicks[nick.lower()] = client
+        client.nick = nick
+        self.__register(client)
+
+    def __register(self, client):
+        if client.registered or client.nick is None or client.user is None:
+            return
+        client.registered = True
+        self.__reply(client, Replies.RPL_WELCOME, f':Welcome to the fake IRC network {client.prefix}')
+        self.__reply(client, Replies.RPL_YOURHOST, f':Your host is {self.__name}')
+        self.__reply(client, Replies.RPL_CREATED, ':This server was created just now')
+        self.__reply(client, Replies.RPL_MYINFO, f'{self.__name} fake i nt')
+        self.__reply(client, Replies.RPL_ISUPPORT,
+                     'CASEMAPPING=ascii CHANTYPES=# PREFIX=(ov)@+ :are supported by this server')
+        self.__reply(client, Replies.ERR_NOMOTD, ':MOTD File is missing')
+
+    def __join(self, client, channel):
+        key = channel.lower()
+        if key in client.channels:
+            return
+        members = self.__channels.setdefault(key, set())
+        members.add(client)
+        client.channels.add(key)
+        for member in members:
+            self.__send(member, f':{client.prefix} JOIN {channel}')
+        self.__names(client, channel)
+
+    def __part(self, client, channel, reason):
+        key = channel.lower()
+        if key not in client.channels:
+            return
+        members = self.__channels[key]
+        for member in members:
+            self.__send(member, f':{client.prefix} PART {channel} :{reason}')
+        members.discard(client)
+        client.channels.discard(key)
+        if not members:
+            del self.__channels[key]
+
+    def __message(self, client, command, target, text):
+        line = f':{client.prefix} {command} {target} :{text}'
+        if target[:1] == '#':
+            for member in self.__channels.get(target.lower(), ()):
+                if member is not client:
+                    self.__send(member, line)
+            return
+        recipient = self.__nicks.get(target.lower())
+        if recipient is None:
+            self.__reply(client, Replies.ERR_NOSUCHNICK, f'{target} :No such nick/channel')
+        else:
+            self.__send(recipient, line)
+
+    def __names(self, client, channel):
+        nicks = [member.nick for member in self.__channels.get(channel.lower(), ())]
+        # Each reply is kept well below the 512 byte line limit.
+        for i in range(0, len(nicks), 40):
+            self.__reply(client, Replies.RPL_NAMREPLY, f'= {channel} :{" ".join(nicks[i:i + 40])}')
+        self.__reply(client, Replies.RPL_ENDOFNAMES, f'{channel} :End of /NAMES list.')
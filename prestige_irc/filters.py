@@ -0,0 +1,283 @@
+import re
+import threading
+
+from prestige_irc.connection import MessageListener
+
+# Patterns which refer to their own groups by number or name cannot be merged with other patterns.
+_GROUP_REFERENCE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+
+
+def glob_to_regex(glob):
+    """
+    Converts an IRC-style glob into a regular expression.
+
+    Only `*` (any number of characters) and `?` (exactly one character) are wildcards;
+    all other characters, including the `[`, `]` and `\\` which are common in nicks, match themselves.
+
+    Parameters
+    ----------
+    glob: str
+        The glob to convert, e.g. `*!*@*.example.com`.
+
+    Returns
+    -------
+    str:
+        A regular expression which matches the whole string the glob matches.
+    """
+    return ''.join('.*' if char == '*' else '.' if char == '?' else re.escape(char) for char in glob) + r'\Z'
+
+
+class MessageFilter(object):
+
+    """
+    A declarative description of the messages a listener is interested in.
+
+    Every criterion which is given must match for a message to be accepted;
+    criteria which are omitted match every message.
+    A `FilterSet` compiles many of these into a combined matcher.
+    """
+
+    def __init__(self, command=None, target=None, nick=None, hostmask=None, pattern=None, keywords=None):
+        """
+        Creates the filter.
+
+        Parameters
+        ----------
+        command: str|collections.iterable (optional)
+            The command, or commands, of the message, e.g. `Commands.PRIVMSG`.
+            Default value is None.
+        target: str|collections.iterable (optional)
+            The target, or targets, of the message (usually #channel or nick), compared case-insensitively.
+            Default value is None.
+        nick: str (optional)
+            A glob matched case-insensitively against the nick of the sender, e.g. `*bot`.
+            Default value is None.
+        hostmask: str (optional)
+            A glob matched case-insensitively against the host of the message (nick!user@host),
+            e.g. `*!*@*.example.com`.
+            Default value is None.
+        pattern: str|re.Pattern (optional)
+            A regular expression searched for in the text of the message.
+            Default value is None.
+        keywords: collections.iterable (optional)
+            Words, of which at least one must be contained in the text of the message, compared case-insensitively.
+            Default value is None.
+        """
+        self.commands = MessageFilter.__as_set(command, str.upper)
+        self.targets = MessageFilter.__as_set(target, str.lower)
+        self.nick = nick
+        self.hostmask = hostmask
+        self.pattern = pattern
+        self.keywords = frozenset(keyword.lower() for keyword in keywords) if keywords else frozenset()
+
+    @staticmethod
+    def __as_set(values, normalize):
+        if values is None:
+            return frozenset()
+        if isinstance(values, str):
+            values = (values,)
+        return frozenset(normalize(value) for value in values)
+
+
+class _Entry(object):
+
+    """A registration of a `FilterSet`, with the parts of its filter resolved to indices of the compiled set."""
+
+    def __init__(self, order, message_filter, listener):
+        self.order = order
+        self.filter = message_filter
+        self.listener = listener
+        self.nick_glob = None
+        self.host_glob = None
+        self.pattern = None
+
+
+class _CompiledFilters(object):
+
+    """An immutable snapshot of the registrations of a `FilterSet`, indexed for matching."""
+
+    def __init__(self, registrations):
+        self.by_command = {}
+        self.any_command = []
+        globs = {}
+        patterns = []
+        keyword_entries = {}
+
+        for order, (message_filter, listener) in enumerate(registrations):
+            entry = _Entry(order, message_filter, listener)
+            if message_filter.commands:
+                for command in message_filter.commands:
+                    self.by_command.setdefault(command, []).append(entry)
+            else:
+                self.any_command.append(entry)
+
+            if message_filter.nick is not None:
+                entry.nick_glob = globs.setdefault(message_filter.nick.lower(), len(globs))
+            if message_filter.hostmask is not None:
+                entry.host_glob = globs.setdefault(message_filter.hostmask.lower(), len(globs))
+            if message_filter.pattern is not None:
+                entry.pattern = len(patterns)
+                patterns.append(message_filter.pattern)
+            for keyword in message_filter.keywords:
+                keyword_entries.setdefault(keyword, []).append(entry)
+
+        self.globs = [None] * len(globs)
+        for glob, index in globs.items():
+            self.globs[index] = re.compile(glob_to_regex(glob), re.DOTALL)
+
+        # Keywords are searched for at every position at once, longest first. When a keyword matches at a position,
+        # every shorter keyword which is a prefix of it matches there as well.
+        # Each keyword has its own group, and a match is looked up by the index of the group which matched rather
+        # than by the matched text, since case-insensitive matching also matches text which does not lowercase to
+        # the keyword (e.g. 'ſt' matches 'st').
+        self.keyword_entries = []
+        self.keywords = None
+        if keyword_entries:
+            ordered = sorted(keyword_entries, key=len, reverse=True)
+            self.keywords = re.compile('(?=(?:' + '|'.join(f'({re.escape(keyword)})' for keyword in ordered) + '))',
+                                       re.IGNORECASE)
+            for keyword in ordered:
+                self.keyword_entries.append([entry for prefix in ordered if keyword.startswith(prefix)
+                                             for entry in keyword_entries[prefix]])
+
+        # Patterns are merged into a single expression of optional lookaheads, one named group per pattern,
+        # so every pattern is tested by one call into the regular expression engine.
+        self.patterns = [None] * len(patterns)
+        merged = []
+        for index, pattern in enumerate(patterns):
+            if isinstance(pattern, str) and not _GROUP_REFERENCE.search(pattern):
+                merged.append(f'(?:(?=.*?(?P<_p{index}>{pattern})))?')
+            else:
+                self.patterns[index] = re.compile(pattern, re.DOTALL) if isinstance(pattern, str) else pattern
+        self.merged = None
+        if merged:
+            try:
+                self.merged = re.compile(''.join(merged), re.DOTALL)
+            except re.error:
+                for index, pattern in enumerate(patterns):
+                    if self.patterns[index] is None:
+                        self.patterns[index] = re.compile(pattern, re.DOTALL)
+
+    def match(self, message):
+        candidates = self.by_command.get(message.command.upper())
+        if self.any_command:
+            candidates = sorted(candidates + self.any_command, key=lambda e: e.order) if candidates \
+                else self.any_command
+        if not candidates:
+            return []
+
+        target = message.target.lower()
+        glob_results = {}
+        keyword_hits = None
+        merged_hits = None
+        matches = []
+        for entry in candidates:
+            message_filter = entry.filter
+            if message_filter.targets and target not in message_filter.targets:
+                continue
+            if entry.nick_glob is not None and not self.__glob(entry.nick_glob, message.nick, glob_results):
+                continue
+            if entry.host_glob is not None and not self.__glob(entry.host_glob, message.host, glob_results):
+                continue
+            if message_filter.keywords:
+                if keyword_hits is None:
+                    keyword_hits = set()
+                    for hit in self.keywords.finditer(message.text):
+                        keyword_hits.update(map(id, self.keyword_entries[hit.lastindex - 1]))
+                if id(entry) not in keyword_hits:
+                    continue
+            if entry.pattern is not None:
+                pattern = self.patterns[entry.pattern]
+                if pattern is not None:
+                    if not pattern.search(message.text):
+                        continue
+                else:
+                    if merged_hits is None:
+                        merged_hits = self.merged.match(message.text).groupdict()
+                    if merged_hits[f'_p{entry.pattern}'] is None:
+                        continue
+            matches.append(entry.listener)
+        return matches
+
+    def __glob(self, index, value, results):
+        result = results.get(index)
+        if result is None:
+            result = results[index] = self.globs[index].match(value.lower()) is not None
+        return result
+
+
+class FilterSet(MessageListener):
+
+    """
+    A listener which dispatches messages to many other listeners,
+    each of which is registered with a declarative `MessageFilter`.
+
+    The filters are compiled into a combined matcher: listeners are indexed by command,
+    keywords are searched for with a single merged expression, and patterns are merged into a single expression,
+    so every matching listener is found in one pass over the text of a message.
+    """
+
+    def __init__(self):
+        """Creates an empty set; add it to a connection with `Connection.add_listener`."""
+        super().__init__(receive=self.__dispatch, message_filter=self.__may_match)
+        self.__registrations = []
+        self.__compiled = _CompiledFilters([])
+        self.__lock = threading.Lock()
+
+    def add(self, message_filter, listener):
+        """
+        Registers a listener which receives the messages matching `message_filter`.
+
+        Parameters
+        ----------
+        message_filter: MessageFilter
+            The filter messages must match.
+        listener: MessageListener|(Connection, IRCMessage) -> None
+            The listener to notify, or a function which takes a connection and a message as parameters.
+            The `accept` method of a `MessageListener` is still called after `message_filter` has matched.
+        """
+        with self.__lock:
+            self.__registrations.append((message_filter, listener))
+            self.__compiled = _CompiledFilters(self.__registrations)
+
+    def remove(self, listener):
+        """
+        Removes every registration of `listener`.
+
+        Parameters
+        ----------
+        listener: MessageListener|(Connection, IRCMessage) -> None
+            The listener to remove.
+        """
+        with self.__lock:
+            self.__registrations = [registration for registration in self.__registrations
+                                    if registration[1] is not listener]
+            self.__compiled = _CompiledFilters(self.__registrations)
+
+    def match(self, message):
+        """
+        Finds the listeners whose filters match `message`.
+
+        Parameters
+        ----------
+        message: IRCMessage
+            The message to match.
+
+        Returns
+        -------
+        list:
+            The matching listeners, in the order they were added.
+        """
+        return self.__compiled.match(message)
+
+    def __may_match(self, connection, message):
+        compiled = self.__compiled
+        return bool(compiled.any_command) or message.command.upper() in compiled.by_command
+
+    def __dispatch(self, connection, message):
+        for listener in self.match(message):
+            if isinstance(listener, MessageListener):
+                if listener.accept(connection=connection, message=message):
+                    listener.receive(connection=connection, message=message)
+            else:
+                listener(connection, message)
@@ -0,0 +1,231 @@
+import re
+import threading
+
+from prestige_irc.filters import glob_to_regex
+from prestige_irc.message import irc_lower
+
+_WILDCARDS = re.compile(r'[*?]')
+
+
+def normalize_mask(mask):
+    """
+    Expands a partial mask into a full `nick!user@host` mask.
+
+    A mask without `!` or `@` is treated as a nick, and a mask without `!` is treated as `user@host`.
+
+    Parameters
+    ----------
+    mask: str
+        The mask to expand, e.g. `baduser`, `*@*.example.com` or `*!*@*.example.com`.
+
+    Returns
+    -------
+    str:
+        The full mask.
+    """
+    if '@' not in mask:
+        return mask + ('@*' if '!' in mask else '!*@*')
+    if '!' not in mask:
+        return '*!' + mask
+    return mask
+
+
+class HostmaskSet(object):
+
+    """
+    A set of wildcard masks (`nick!user@host`), e.g. an ignore or ban list,
+    which is indexed so that matching a host does not compare it with every mask.
+
+    Masks are indexed by the literal suffix of their host part (`*!*@*.example.com` by `.example.com`),
+    or by the literal prefix of their nick part when the host part ends with a wildcard.
+    Only the masks found through the index are matched in full.
+    """
+
+    def __init__(self, masks=(), casemapping='rfc1459'):
+        """
+        Creates the set.
+
+        Parameters
+        ----------
+        masks: collections.iterable (optional)
+            The masks to add to the set.
+            Default value is an empty tuple.
+        casemapping: str (optional)
+            The casemapping used to compare masks and hosts case-insensitively, see `irc_lower`.
+            Default value is 'rfc1459'.
+        """
+        self.__casemapping = casemapping
+        # Maps each normalized mask to the compiled expression which matches it.
+        self.__masks = {}
+        # Masks whose host part has no wildcards, by host.
+        self.__exact_hosts = {}
+        # Masks by the literal suffix of their host part, and the number of suffixes of each length.
+        self.__host_suffixes = {}
+        self.__suffix_lengths = {}
+        # Masks whose host part ends with a wildcard, by the literal prefix of their nick part.
+        self.__nick_prefixes = {}
+        self.__prefix_lengths = {}
+        # Masks which cannot be indexed, e.g. `*!*@*`.
+        self.__unindexed = set()
+        self.__lock = threading.Lock()
+        for mask in masks:
+            self.add(mask)
+
+    def __len__(self):
+        return len(self.__masks)
+
+    def __iter__(self):
+        with self.__lock:
+            return iter(list(self.__masks))
+
+    def __contains__(self, mask):
+        return irc_lower(normalize_mask(mask), self.__casemapping) in self.__masks
+
+    def add(self, mask):
+        """
+        Adds a mask to the set.
+
+        Parameters
+        ----------
+        mask: str
+            The mask to add. Partial masks are expanded with `normalize_mask`.
+        """
+        mask = irc_lower(normalize_mask(mask), self.__casemapping)
+        with self.__lock:
+            if mask in self.__masks:
+                return
+            self.__masks[mask] = re.compile(glob_to_regex(mask), re.DOTALL)
+            index, key, lengths = self.__index_of(mask)
+            if index is None:
+                self.__unindexed.add(mask)
+                return
+            index.setdefault(key, set()).add(mask)
+            if lengths is not None:
+                lengths[len(key)] = lengths.get(len(key), 0) + 1
+
+    def discard(self, mask):
+        """
+        Removes a mask from the set, if it is present.
+
+        Parameters
+        ----------
+        mask: str
+            The mask to remove. Partial masks are expanded with `normalize_mask`.
+        """
+        mask = irc_lower(normalize_mask(mask), self.__casemapping)
+        with self.__lock:
+            if self.__masks.pop(mask, None) is None:
+                return
+            index, key, lengths = self.__index_of(mask)
+            if index is None:
+                self.__unindexed.discard(mask)
+                return
+            masks = index[key]
+            masks.discard(mask)
+            if not masks:
+                del index[key]
+            if lengths is not None:
+                lengths[len(key)] -= 1
+                if not lengths[len(key)]:
+                    del lengths[len(key)]
+
+    def match(self, host):
+        """
+        Finds the masks which match `host`.
+
+        Parameters
+        ----------
+        host: str
+            The host to match (nick!user@host), e.g. `IRCMessage.host`.
+
+        Returns
+        -------
+        list:
+            The normalized, lowercased masks which match `host`.
+        """
+        folded = self.__fold(host)
+        return [mask for mask, expression in self.__candidates(folded) if expression.match(folded)]
+
+    def matches(self, host):
+        """
+        Checks if any mask matches `host`.
+
+        Parameters
+        ----------
+        host: str
+            The host to match (nick!user@host), e.g. `IRCMessage.host`.
+
+        Returns
+        -------
+        bool:
+            If at least one mask matches `host`.
+        """
+        folded = self.__fold(host)
+        return any(expression.match(folded) for _, expression in self.__candidates(folded))
+
+    def contains_sender(self, connection, message):
+        """
+        A `MessageListener` filter which accepts messages whose sender matches a mask in the set.
+
+        Parameters
+        ----------
+        connection: Connection
+            The connection the message was sent over.
+        message: IRCMessage
+            The message received.
+
+        Returns
+        -------
+        bool:
+            If the host of the message matches a mask.
+        """
+        return bool(message.host) and self.matches(message.host)
+
+    def excludes_sender(self, connection, message):
+        """
+        A `MessageListener` filter which accepts messages whose sender does not match any mask in the set,
+        e.g. to skip messages from ignored users.
+
+        Parameters
+        ----------
+        connection: Connection
+            The connection the message was sent over.
+        message: IRCMessage
+            The message received.
+
+        Returns
+        -------
+        bool:
+            If the host of the message matches no mask.
+        """
+        return not self.contains_sender(connection, message)
+
+    def __fold(self, text):
+        return irc_lower(text, self.__casemapping)
+
+    def __index_of(self, mask):
+        """Finds the index, key and key length counts used for a normalized mask."""
+        nick_user, _, host = mask.rpartition('@')
+        wildcards = list(_WILDCARDS.finditer(host))
+        if not wildcards:
+            return self.__exact_hosts, host, None
+        suffix = host[wildcards[-1].end():]
+        if suffix:
+            return self.__host_suffixes, suffix, self.__suffix_lengths
+        wildcard = _WILDCARDS.search(nick_user)
+        prefix = nick_user[:wildcard.start()] if wildcard else nick_user
+        if prefix:
+            return self.__nick_prefixes, prefix, self.__prefix_lengths
+        return None, None, None
+
+    def __candidates(self, folded):
+        """Finds the masks which may match a lowercased host using the indices, along with their expressions."""
+        nick_user, _, host_part = folded.rpartition('@')
+        with self.__lock:
+            candidates = set(self.__exact_hosts.get(host_part, ()))
+            for length in self.__suffix_lengths:
+                candidates.update(self.__host_suffixes.get(host_part[-length:], ()))
+            for length in self.__prefix_lengths:
+                candidates.update(self.__nick_prefixes.get(nick_user[:length], ()))
+            candidates.update(self.__unindexed)
+            return [(mask, self.__masks[mask]) for mask in candidates]
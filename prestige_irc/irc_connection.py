@@ -1,17 +1,34 @@
+import asyncio
+import base64
+import datetime
+import queue
 import socket
 import ssl
+import threading
 
 from prestige_irc import connection
+from prestige_irc.batch import BatchAggregator
 from prestige_irc.commands import Commands
 from prestige_irc.connection import MessageListener
-from prestige_irc.message import IRCMessage
+from prestige_irc.message import IRCBatch, IRCMessage, chunk_targets, irc_lower
+from prestige_irc.replies import Replies
 
 
 class IRCConnection(connection.Connection):
 
     """Creates a connection to an IRC network."""
 
-    def __init__(self, nick):
+    # The IRCv3 capabilities requested by default.
+    # `batch` is not requested by default: with it, the messages of a batch (e.g. the QUITs of a netsplit) reach the
+    # listeners as a single `IRCBatch` instead of one by one, which listeners must be written to expect.
+    DEFAULT_CAPABILITIES = ('message-tags', 'multi-prefix', 'server-time')
+
+    # Replies which end SASL authentication, successfully or not.
+    SASL_COMPLETE = frozenset((Replies.RPL_SASLSUCCESS, Replies.ERR_SASLFAIL, Replies.ERR_SASLTOOLONG,
+                               Replies.ERR_SASLABORTED, Replies.ERR_SASLALREADY))
+
+    def __init__(self, nick, capabilities=DEFAULT_CAPABILITIES, channels=None, password=None,
+                 sasl_mechanism=None, sasl_username='', sasl_password='', scrollback=None):
         """
         Readies the connection to the irc network, and sets up the initial nick name to use.
 
@@ -19,10 +36,59 @@ class IRCConnection(connection.Connection):
         ----------
         nick: str
             The irc nick name to use.
+        capabilities: collections.iterable (optional)
+            The IRCv3 capabilities to request from the server during registration.
+            Capabilities the server does not offer are not requested.
+            If empty, capability negotiation is skipped.
+            With `batch`, batched messages are dispatched to the listeners as one `IRCBatch` rather than one by one.
+            Default value is `IRCConnection.DEFAULT_CAPABILITIES`.
+        channels: collections.iterable (optional)
+            The channels to join as soon as the server has accepted the registration (RPL_WELCOME).
+            Default value is None.
+        password: str (optional)
+            The connection password, sent with PASS.
+            Default value is None.
+        sasl_mechanism: str (optional)
+            The SASL mechanism to authenticate with during registration: 'PLAIN' or 'EXTERNAL'.
+            EXTERNAL authenticates with the client certificate of the TLS connection.
+            Default value is None, which does not authenticate.
+        sasl_username: str (optional)
+            The account name to authenticate as with PLAIN.
+            Default value is an empty string.
+        sasl_password: str (optional)
+            The account password to authenticate with PLAIN.
+            Default value is an empty string.
+        scrollback: Scrollback (optional)
+            A store which records the most recent lines of each channel as they are received.
+            Default value is None, which records nothing.
         """
         super().__init__()
         # Set the local user nickname.
         self.__nick = nick
+        # Capability negotiation state.
+        self.__requested_capabilities = frozenset(capabilities)
+        self.__available_capabilities = {}
+        self.__enabled_capabilities = set()
+        self.__pending_capability_requests = 0
+        self.__capabilities_listed = False
+        self.__negotiating_capabilities = False
+        # Registration state.
+        self.__channels = list(channels) if channels else []
+        self.__password = password
+        self.__sasl_mechanism = sasl_mechanism.upper() if sasl_mechanism else None
+        self.__sasl_username = sasl_username
+        self.__sasl_password = sasl_password
+        self.__authenticating = False
+        # The features the server advertises in RPL_ISUPPORT, by token.
+        self.__isupport = {}
+        # Collects batched messages so that each batch is dispatched to the listeners as one `IRCBatch`.
+        self.__batches = BatchAggregator()
+        self.add_processor(self.__on_capability)
+        self.add_processor(self.__on_registration)
+        self.add_processor(self.__batches)
+        self.__scrollback = scrollback
+        if scrollback is not None:
+            self.add_processor(scrollback)
         # Listener which automatically handles ping responses.
         self.add_listener(MessageListener(message_filter=lambda conn, msg: msg.command == Commands.PING,
                                           receive=lambda conn, msg: conn.cmd_pong(msg.target)))
@@ -36,9 +102,9 @@ class IRCConnection(connection.Connection):
         data: bytes
             The bytes to convert into an `IRCMessage`.
         """
-        return IRCMessage(data.decode('utf-8'))
+        return IRCMessage(data.decode('utf-8'), raw_bytes=data)
 
-    def connect(self, ip_address, port=6697, timeout=None, enable_ssl=True):
+    def connect(self, ip_address, port=6697, timeout=None, enable_ssl=True, ssl_context=None):
         """
         Attempts to connect to the specified IP address and port.
 
@@ -56,6 +122,10 @@ class IRCConnection(connection.Connection):
         enable_ssl: bool (optional)
             If the connection should be made with SSL.
             Default value is True.
+        ssl_context: ssl.SSLContext (optional)
+            The context used to secure the connection, e.g. to trust a self-signed certificate
+            or present a client certificate for SASL EXTERNAL.
+            Default value is None, which uses `ssl.create_default_context()`.
 
         Returns
         -------
@@ -63,89 +133,182 @@ class IRCConnection(connection.Connection):
             If the connection was successfully established.
         """
         if enable_ssl:
-            return self.__connect_ssl(ip_address=ip_address, port=port)
+            return self.__connect_ssl(ip_address=ip_address, port=port, timeout=timeout, ssl_context=ssl_context)
         else:
-            return self.__connect(ip_address=ip_address, port=port)
+            return super().connect(ip_address=ip_address, port=port, timeout=timeout)
 
-    def __connect(self, ip_address, port, timeout=None):
+    def __connect_ssl(self, ip_address, port, timeout=None, ssl_context=None):
         """
-        Attempts to connect to the specified IP address and port.
+        Attempts to connect to the specified IP address and port, and then secures the connection with TLS.
 
         Parameters
         ----------
         ip_address: str
-            The IP address to connect to.
+            The IP address, or host name, to connect to.
         port: int
             The port number to bind to.
         timeout: int|None (optional)
-            The number of seconds to wait to stop attempting to connect if a connection has not yet been made.
+            The number of seconds to wait to stop attempting to connect if a connection has not yet been made,
+            including the TLS handshake.
             Default value is None.
+        ssl_context: ssl.SSLContext (optional)
+            The context used to secure the connection.
+            Default value is None, which uses `ssl.create_default_context()`.
 
         Returns
         -------
         bool:
             If the connection was successfully established.
         """
-        connection_successful = super().connect(ip_address=ip_address, port=port, timeout=timeout)
-        if connection_successful:
-            self.__on_connect()
-        return connection_successful
-
-    def __connect_ssl(self, ip_address, port, timeout=None):
-        """
-        Attempts to connect to the specified IP address and port.
-
-        Parameters
-        ----------
-        ip_address: str
-            The IP address to connect to.
-        port: int
-            The port number to bind to.
-        timeout: int|None (optional)
-            The number of seconds to wait to stop attempting to connect if a connection has not yet been made.
-            Default value is None.
-
-        Returns
-        -------
-        bool:
-            If the connection was successfully established.
-        """
-        sock = socket.socket()
-        sock.settimeout(timeout)
-        ssl_socket = ssl.create_default_context().wrap_socket(sock=sock, server_hostname=ip_address)
-        return self.connect_socket(sock=ssl_socket, ip_address=ip_address, port=port)
-
-    def connect_socket(self, sock, ip_address, port):
-        """Connect to a server.
+        if self.is_connection_alive:
+            return False
+        try:
+            sock = connection.open_connection(host=ip_address, port=port, timeout=timeout)
+            try:
+                context = ssl_context if ssl_context is not None else ssl.create_default_context()
+                ssl_socket = context.wrap_socket(sock=sock, server_hostname=ip_address)
+            except socket.error:
+                sock.close()
+                raise
+        except socket.error as err:
+            print(f'Caught exception socket.error:\n{str(err)}')
+            return False
+        ssl_socket.settimeout(None)
+        return self.attach_socket(sock=ssl_socket)
+
+    def attach_socket(self, sock):
+        """
+        Starts using a socket which is already connected to an IRC server, and registers with the server.
 
         Parameters
         ----------
-        sock: SSLSocket
-            The socket to connect with.
-        ip_address: str
-            The IP address of the server.
-        port: int
-            The port number to bind to.
+        sock: socket.py|SSLSocket
+            The connected socket.
 
         Returns
         -------
         bool:
             If the connection was successfully established.
-
-        Throws
-        ------
-        socket.error:
-            If a connection could not be made.
         """
-        connection_successful = super().connect_socket(sock=sock, ip_address=ip_address, port=port)
+        connection_successful = super().attach_socket(sock=sock)
         if connection_successful:
             self.__on_connect()
         return connection_successful
 
     def __on_connect(self):
-        """Runs IRC commands needed after the connection has been established."""
-        self.cmd_nick(nick=self.__nick)
-        self.cmd_user(real_name=self.__nick)
+        """
+        Runs IRC commands needed after the connection has been established.
+
+        The whole registration is sent in a single write, without waiting for the server to reply to each command.
+        When authenticating with SASL, the `sasl` capability and the AUTHENTICATE command are pipelined as well;
+        the server handles the capability request before it reads AUTHENTICATE.
+        """
+        self.__available_capabilities = {}
+        self.__enabled_capabilities = set()
+        self.__pending_capability_requests = 0
+        self.__capabilities_listed = False
+        self.__authenticating = self.__sasl_mechanism is not None
+        self.__isupport = {}
+        self.__batches.clear()
+
+        lines = []
+        if self.__requested_capabilities or self.__authenticating:
+            # Registration is suspended by the server until negotiation is ended with CAP END.
+            self.__negotiating_capabilities = True
+            lines.append(self.__format_command(command=Commands.CAP, params='LS 302'))
+        if self.__authenticating:
+            self.__pending_capability_requests += 1
+            lines.append(self.__format_command(command=Commands.CAP, params='REQ :sasl'))
+        if self.__password is not None:
+            lines.append(self.__format_command(command=Commands.PASS, params=self.__password))
+        lines.append(self.__format_command(command=Commands.NICK, params=self.__nick))
+        lines.append(self.__format_command(command=Commands.USER, params=f'{self.__nick} 0 * :{self.__nick}'))
+        if self.__authenticating:
+            lines.append(self.__format_command(command=Commands.AUTHENTICATE, params=self.__sasl_mechanism))
+        self.send_data(bytes(''.join(f'{line}\r\n' for line in lines), 'utf-8'))
+
+    def __on_registration(self, connection, message):
+        """Processor which completes SASL authentication, records the server's features and joins the channels."""
+        if message.command == Replies.RPL_ISUPPORT:
+            # The tokens are between the nick and the trailing text; `-TOKEN` withdraws a feature.
+            for token in message.args[1:-1]:
+                if token[:1] == '-':
+                    self.__isupport.pop(token[1:], None)
+                else:
+                    name, _, value = token.partition('=')
+                    self.__isupport[name] = value
+        elif message.command == Commands.AUTHENTICATE and self.__authenticating:
+            if message.target == '+':
+                self.__send_sasl_response()
+        elif message.command in IRCConnection.SASL_COMPLETE and self.__authenticating:
+            self.__authenticating = False
+            self.__end_capability_negotiation()
+        elif message.command == Replies.RPL_WELCOME and self.__channels:
+            # Many channels do not fit on one line, which the server would truncate.
+            channels = [f'#{channel}' if channel[0] != '#' else channel for channel in self.__channels]
+            for chunk in chunk_targets(f'{Commands.JOIN} ', channels, ','):
+                self.cmd_join(channels=chunk)
+        return message
+
+    def __send_sasl_response(self):
+        """Sends the credentials for the SASL mechanism, base64 encoded in chunks of at most 400 bytes."""
+        if self.__sasl_mechanism == 'PLAIN':
+            credentials = f'\0{self.__sasl_username}\0{self.__sasl_password}'.encode('utf-8')
+            response = base64.b64encode(credentials).decode('ascii')
+        else:
+            response = ''
+        chunks = [response[i:i + 400] for i in range(0, len(response), 400)]
+        # An empty response, or one whose last chunk is exactly 400 bytes, is terminated with `+`.
+        if not chunks or len(chunks[-1]) == 400:
+            chunks.append('+')
+        self.send_data(bytes(''.join(f'{Commands.AUTHENTICATE} {chunk}\r\n' for chunk in chunks), 'utf-8'))
+
+    def __end_capability_negotiation(self):
+        """Sends CAP END once the capabilities have been listed, every request answered and SASL completed."""
+        if self.__negotiating_capabilities and self.__capabilities_listed \
+                and self.__pending_capability_requests <= 0 and not self.__authenticating:
+            self.__negotiating_capabilities = False
+            self.cmd_cap(subcommand='END')
+
+    def __on_capability(self, connection, message):
+        """Processor which negotiates the requested capabilities with the server."""
+        if message.command != Commands.CAP or len(message.args) < 2:
+            return message
+
+        subcommand = message.args[1].upper()
+        capabilities = message.text.split() if len(message.args) > 2 else []
+        if subcommand in ('LS', 'NEW'):
+            for capability in capabilities:
+                name, _, value = capability.partition('=')
+                self.__available_capabilities[name] = value
+            # A `*` before the list means the list continues on the next line.
+            if len(message.args) > 3 and message.args[2] == '*':
+                return message
+            self.__capabilities_listed = True
+            # The `sasl` capability is requested along with the registration.
+            wanted = [name for name in self.__requested_capabilities - {'sasl'}
+                      if name in self.__available_capabilities and name not in self.__enabled_capabilities]
+            if wanted:
+                self.__pending_capability_requests += 1
+                self.cmd_cap(subcommand='REQ', params=f':{" ".join(sorted(wanted))}')
+        elif subcommand == 'ACK':
+            self.__pending_capability_requests -= 1
+            for capability in capabilities:
+                if capability[0] == '-':
+                    self.__enabled_capabilities.discard(capability[1:])
+                else:
+                    self.__enabled_capabilities.add(capability)
+        elif subcommand == 'NAK':
+            self.__pending_capability_requests -= 1
+            if 'sasl' in capabilities:
+                self.__authenticating = False
+        elif subcommand == 'DEL':
+            for capability in capabilities:
+                self.__available_capabilities.pop(capability, None)
+                self.__enabled_capabilities.discard(capability)
+
+        self.__end_capability_negotiation()
+        return message
 
     @property
     def nick(self):
@@ -162,6 +325,204 @@ class IRCConnection(connection.Connection):
         """
         return self.__nick
 
+    @property
+    def scrollback(self):
+        """
+        Gets the store of the most recent lines of each channel, which was passed to the constructor.
+
+        Returns
+        -------
+        Scrollback|None:
+            The scrollback, or None if the connection does not keep one.
+        """
+        return self.__scrollback
+
+    @property
+    def capabilities(self):
+        """
+        Gets the IRCv3 capabilities which the server has enabled for this connection.
+
+        Returns
+        -------
+        frozenset:
+            The names of the enabled capabilities.
+        """
+        return frozenset(self.__enabled_capabilities)
+
+    @property
+    def isupport(self):
+        """
+        Gets the features the server advertised in RPL_ISUPPORT, e.g. `CASEMAPPING`, `MONITOR` or `WATCH`.
+
+        Returns
+        -------
+        dict:
+            A copy of the advertised tokens, mapped to their values, which are empty strings for tokens without one.
+        """
+        return dict(self.__isupport)
+
+    # ----------------- #
+    # IRCv3 CHATHISTORY #
+    # ----------------- #
+
+    def chathistory(self, target, since=None, until=None, page_size=100, timeout=30):
+        """
+        Pages through the history of a channel or query with the IRCv3 CHATHISTORY extension, oldest first,
+        e.g. to backfill the messages sent while the connection was down.
+
+        The server must advertise CHATHISTORY in RPL_ISUPPORT, and the `draft/chathistory`, `batch` and
+        `server-time` capabilities should be requested in the constructor.
+        Only one page is held at a time: the next page is requested as soon as the current one arrives,
+        before its messages are yielded, so the server answers while they are processed.
+        The pages are taken from the processors, so they are not dispatched to the listeners as live messages.
+
+        Parameters
+        ----------
+        target: str
+            The channel or nick whose history to fetch.
+        since: float|str (optional)
+            The time, in seconds since the epoch, or the `msgid` of the message after which the history starts.
+            Default value is None, which starts at the oldest message the server keeps.
+        until: float|str (optional)
+            The time, in seconds since the epoch, or the `msgid` of the message before which the history ends.
+            Default value is None, which ends at the latest message.
+        page_size: int (optional)
+            The number of messages requested at once; lowered to the server's limit if it advertises one.
+            Default value is 100.
+        timeout: float (optional)
+            The number of seconds to wait for each page. The history ends early if a page does not arrive in time,
+            or the server fails the request.
+            Default value is 30.
+
+        Returns
+        -------
+        generator:
+            The `IRCMessage`s of the history.
+        """
+        for page in self.__chathistory_pages(target, since, until, page_size, timeout, queue.Queue()):
+            yield from page
+
+    async def chathistory_async(self, target, since=None, until=None, page_size=100, timeout=30):
+        """
+        Pages through the history of a channel or query without blocking the event loop; see `chathistory`.
+
+        Returns
+        -------
+        async_generator:
+            The `IRCMessage`s of the history.
+        """
+        loop = asyncio.get_running_loop()
+        received = queue.Queue()
+        pages = self.__chathistory_pages(target, since, until, page_size, timeout, received)
+        pending = None
+        try:
+            while True:
+                # Waiting for a page blocks, so it is done in the default executor. The wait is shielded, so if the
+                # consumer is cancelled, the generator is only closed once the executor has returned from it.
+                pending = loop.run_in_executor(None, next, pages, None)
+                page = await asyncio.shield(pending)
+                if page is None:
+                    return
+                for message in page:
+                    yield message
+        finally:
+            if pending is not None and not pending.done():
+                # An empty page ends the history, which wakes the executor if it is waiting for a page.
+                received.put(None)
+                await asyncio.wait([pending])
+            pages.close()
+
+    def __chathistory_pages(self, target, since, until, page_size, timeout, pages):
+        """Requests the pages of a history one at a time into the `pages` queue, and yields the messages of each."""
+        limit = self.__isupport.get('CHATHISTORY', '')
+        limit = min(page_size, int(limit)) if limit.isdigit() and int(limit) > 0 else page_size
+        casemapping = self.__isupport.get('CASEMAPPING') or 'rfc1459'
+        key = irc_lower(target, casemapping)
+        # The number of requests not answered yet, and whether the generator was closed; a reply to a request made
+        # before it was closed is still captured, and discarded, so it is not dispatched as live messages.
+        state = {'awaiting': 0, 'closed': False}
+        lock = threading.Lock()
+
+        def answered():
+            with lock:
+                if state['awaiting'] is None:
+                    return
+                state['awaiting'] -= 1
+                release = state['closed'] and state['awaiting'] <= 0
+            if release:
+                release_capture()
+
+        def capture(connection, message):
+            if isinstance(message, IRCBatch) and message.type.endswith('chathistory') and message.params \
+                    and irc_lower(message.params[0], casemapping) == key:
+                if not state['closed']:
+                    pages.put(message.messages)
+                answered()
+                return None
+            # FAIL CHATHISTORY <code> <context...> :<description>, whose context holds the target of the request.
+            if message.command == Commands.FAIL and message.target == Commands.CHATHISTORY \
+                    and any(irc_lower(arg, casemapping) == key for arg in message.args[2:]):
+                if not state['closed']:
+                    pages.put(None)
+                answered()
+            return message
+
+        def release_capture():
+            with lock:
+                if state['awaiting'] is None:
+                    return
+                state['awaiting'] = None
+            self.remove_processor(capture)
+
+        self.add_processor(capture)
+        try:
+            end = IRCConnection.__history_reference(until) if until is not None else None
+
+            def request(start):
+                with lock:
+                    state['awaiting'] += 1
+                self.cmd_chathistory(subcommand='BETWEEN' if end else 'AFTER', target=target,
+                                     references=[start, end] if end else [start], limit=limit)
+
+            request(IRCConnection.__history_reference(since if since is not None else 0.0))
+            while True:
+                try:
+                    page = pages.get(timeout=timeout)
+                except queue.Empty:
+                    return
+                if not page:
+                    return
+                # The next page is requested before this one is processed; a short page is the last one.
+                reference = IRCConnection.__history_reference(page[-1]) if len(page) >= limit else None
+                if reference is not None:
+                    request(reference)
+                yield page
+                if reference is None:
+                    return
+        finally:
+            with lock:
+                state['closed'] = True
+                pending = state['awaiting']
+            if not pending:
+                release_capture()
+            else:
+                # A reply which never arrives must not leave the processor installed for good.
+                timer = threading.Timer(timeout, release_capture)
+                timer.daemon = True
+                timer.start()
+
+    @staticmethod
+    def __history_reference(value):
+        """Formats a time, a msgid or the position of a received message as a CHATHISTORY reference."""
+        if isinstance(value, IRCMessage):
+            if value.tags.get('msgid'):
+                return f'msgid={value.tags["msgid"]}'
+            return f'timestamp={value.tags["time"]}' if value.tags.get('time') else None
+        if isinstance(value, str):
+            return value if value.startswith(('msgid=', 'timestamp=')) else f'msgid={value}'
+        moment = datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
+        return f'timestamp={moment.isoformat(timespec="milliseconds").replace("+00:00", "Z")}'
+
     # --------------------------- #
     # IRC Commands Implementation #
     # --------------------------- #
@@ -191,10 +552,33 @@ class IRCConnection(connection.Connection):
             If False is returned, this typically means the connection has been terminated.
         """
         if self.is_connection_alive:
-            self.send(f'{prefix}{command}' + f' {params}' if params else '')
+            self.send(self.__format_command(command=command, prefix=prefix, params=params))
             return True
         return False
 
+    @staticmethod
+    def __format_command(command, prefix='', params=''):
+        """
+        Formats a command as it is sent by `send_command`, without the CR-LF ending.
+
+        Parameters
+        ----------
+        command: str
+            The irc command, which can be found in commands.Commands.
+        prefix: str (optional)
+            A prefix to the command.
+            Default value is an empty string.
+        params: str (optional)
+            The parameters of the command, in one string.
+            Default value is an empty string.
+
+        Returns
+        -------
+        str:
+            The formatted command.
+        """
+        return f'{prefix}{command} {params}' if params else f'{prefix}{command}'
+
     def cmd_admin(self, target=''):
         """
         Instructs the server to return information about the administrators of the server specified by `target`,
@@ -222,6 +606,40 @@ class IRCConnection(connection.Connection):
         """
         self.send_command(command=Commands.AWAY, params=message)
 
+    def cmd_cap(self, subcommand, params=''):
+        """
+        Sends an IRCv3 capability negotiation command.
+        This is done automatically upon calling IRCConnection#connect, using the capabilities passed to the constructor.
+
+        Parameters
+        ----------
+        subcommand: str
+            The subcommand, e.g. LS, LIST, REQ or END.
+        params: str (optional)
+            The parameters of the subcommand, e.g. `:batch server-time` for REQ.
+            Default value is an empty string.
+        """
+        self.send_command(command=Commands.CAP, params=f'{subcommand} {params}' if params else subcommand)
+
+    def cmd_chathistory(self, subcommand, target, references, limit):
+        """
+        Requests the history of a channel or query with the IRCv3 CHATHISTORY extension.
+        Support is indicated in a RPL_ISUPPORT reply (numeric 005) with the CHATHISTORY keyword.
+        The history is sent in a `chathistory` BATCH; see `IRCConnection.chathistory`.
+
+        Parameters
+        ----------
+        subcommand: str
+            BEFORE, AFTER, LATEST, AROUND or BETWEEN.
+        target: str
+            The channel or nick whose history to request.
+        references: list
+            The references of the subcommand, e.g. ['timestamp=2020-01-01T00:00:00.000Z'] or ['msgid=abc'].
+        limit: int
+            The maximum number of messages to send.
+        """
+        self.send_command(command=Commands.CHATHISTORY, params=f'{subcommand} {target} {" ".join(references)} {limit}')
+
     def cmd_cnotice(self, nickname, channel, message):
         """
         Sends a channel NOTICE message to `nickname` on `channel` that bypasses flood protection limits.
@@ -558,6 +976,22 @@ class IRCConnection(connection.Connection):
         self.send_command(command=Commands.MODE,
                           params=f'{nickname} {flags}' + f' {params}' if params else '')
 
+    def cmd_monitor(self, subcommand, targets=None):
+        """
+        Manages the list of nicknames the server notifies the user about when they connect or disconnect.
+        Support is indicated in a RPL_ISUPPORT reply (numeric 005) with the MONITOR keyword.
+
+        Parameters
+        ----------
+        subcommand: str
+            '+' to add `targets`, '-' to remove them, 'C' to clear the list, 'L' to list it,
+            or 'S' to query the status of every target.
+        targets: list (optional)
+            The nicknames to add or remove.
+        """
+        self.send_command(command=Commands.MONITOR,
+                          params=f'{subcommand} {",".join(targets)}' if targets else subcommand)
+
     def cmd_motd(self, server=''):
         """
         Returns the message of the day on `server` or the current server if it is omitted.
@@ -600,6 +1034,19 @@ class IRCConnection(connection.Connection):
         self.__nick = nick
         self.send_command(command=Commands.NICK, params=nick)
 
+    def cmd_notice(self, target, message):
+        """
+        Send a notice to a channel or a user. Unlike with PRIVMSG, automatic replies must never be sent to a notice.
+
+        Parameters
+        ----------
+        target: str
+            The user or channel to send the notice to.
+        message: str
+            The notice to send.
+        """
+        self.send_command(command=Commands.NOTICE, params=f'{target} :{message}')
+
     def cmd_privmsg(self, target, message):
         """
         Send a message to a channel or a user.
@@ -646,6 +1093,17 @@ class IRCConnection(connection.Connection):
                           params=','.join((f'#{channel}' if channel[0] != '#' else channel)
                                           for channel in channels) + f' :{reason}')
 
+    def cmd_ping(self, token):
+        """
+        Sends a ping message to the server, which the server answers with a PONG containing `token`.
+
+        Parameters
+        ----------
+        token: str
+            The token the server should send back.
+        """
+        self.send_command(command=Commands.PING, params=f':{token}')
+
     def cmd_pong(self, message):
         """
         Sends a pong message to the server
@@ -668,3 +1126,19 @@ class IRCConnection(connection.Connection):
             Default is an empty string.
         """
         self.send_command(command=Commands.QUIT, params=reason)
+
+    def cmd_watch(self, added=None, removed=None):
+        """
+        Manages the list of nicknames the server notifies the user about when they connect or disconnect.
+        Support is indicated in a RPL_ISUPPORT reply (numeric 005) with the WATCH keyword.
+        Without parameters, the server lists the status of every nickname on the list.
+
+        Parameters
+        ----------
+        added: list (optional)
+            The nicknames to add to the list.
+        removed: list (optional)
+            The nicknames to remove from the list.
+        """
+        changes = [f'+{nick}' for nick in added or ()] + [f'-{nick}' for nick in removed or ()]
+        self.send_command(command=Commands.WATCH, params=' '.join(changes))
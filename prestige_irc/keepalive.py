@@ -0,0 +1,283 @@
+import bisect
+import itertools
+import queue
+import socket
+import threading
+import time
+
+from prestige_irc.commands import Commands
+from prestige_irc.connection import MessageListener
+
+
+class LagHistogram(object):
+
+    """A thread-safe histogram of round-trip times, in seconds."""
+
+    DEFAULT_BOUNDS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        """
+        Creates an empty histogram.
+
+        Parameters
+        ----------
+        bounds: collections.iterable (optional)
+            The upper bounds of each bucket, in seconds.
+            Values greater than the largest bound are counted in an extra overflow bucket.
+            Default value is `LagHistogram.DEFAULT_BOUNDS`.
+        """
+        self.__bounds = sorted(bounds)
+        self.__counts = [0] * (len(self.__bounds) + 1)
+        self.__count = 0
+        self.__total = 0.0
+        self.__min = None
+        self.__max = None
+        self.__lock = threading.Lock()
+
+    def record(self, value):
+        """
+        Adds a round-trip time to the histogram.
+
+        Parameters
+        ----------
+        value: float
+            The round-trip time, in seconds.
+        """
+        with self.__lock:
+            self.__counts[bisect.bisect_left(self.__bounds, value)] += 1
+            self.__count += 1
+            self.__total += value
+            self.__min = value if self.__min is None else min(self.__min, value)
+            self.__max = value if self.__max is None else max(self.__max, value)
+
+    @property
+    def count(self):
+        """
+        Returns
+        -------
+        int:
+            The number of values recorded.
+        """
+        return self.__count
+
+    @property
+    def mean(self):
+        """
+        Returns
+        -------
+        float|None:
+            The mean of the values recorded, or None if no values have been recorded.
+        """
+        with self.__lock:
+            return self.__total / self.__count if self.__count else None
+
+    @property
+    def min(self):
+        """
+        Returns
+        -------
+        float|None:
+            The smallest value recorded, or None if no values have been recorded.
+        """
+        return self.__min
+
+    @property
+    def max(self):
+        """
+        Returns
+        -------
+        float|None:
+            The largest value recorded, or None if no values have been recorded.
+        """
+        return self.__max
+
+    @property
+    def buckets(self):
+        """
+        Returns
+        -------
+        list:
+            A list of (upper bound, count) tuples, the last of which has an upper bound of `float('inf')`.
+        """
+        with self.__lock:
+            return list(zip(self.__bounds + [float('inf')], self.__counts))
+
+    def percentile(self, percent):
+        """
+        Estimates a percentile of the values recorded, using the upper bound of the bucket the percentile falls in.
+
+        Parameters
+        ----------
+        percent: float
+            The percentile, from 0 to 100.
+
+        Returns
+        -------
+        float|None:
+            The estimated percentile, or None if no values have been recorded.
+            The largest value recorded is returned if the percentile falls in the overflow bucket.
+        """
+        with self.__lock:
+            if not self.__count:
+                return None
+            rank = percent / 100 * self.__count
+            seen = 0
+            for bound, count in zip(self.__bounds, self.__counts):
+                seen += count
+                if seen >= rank:
+                    return min(bound, self.__max)
+            return self.__max
+
+
+class KeepAlive(object):
+
+    """
+    Periodically sends PINGs over an `IRCConnection`, measures how long the server takes to answer them,
+    and disconnects the connection once a PING has gone unanswered for too long.
+
+    Without this, a connection which silently died is only noticed once the operating system's TCP timeout expires,
+    since the listen thread waits for data indefinitely.
+    PINGs are sent from their own thread, so a send which blocks because the peer stopped reading does not stop
+    the connection from being declared dead; a send which fails declares it dead at once.
+    """
+
+    TOKEN_PREFIX = 'prestige-keepalive-'
+
+    def __init__(self, connection, interval=30, dead_after=90, on_dead=None, histogram=None):
+        """
+        Readies the keepalive for `connection`; call `start` to begin sending PINGs.
+
+        Parameters
+        ----------
+        connection: IRCConnection
+            The connection to keep alive.
+        interval: float (optional)
+            The number of seconds between PINGs.
+            Default value is 30.
+        dead_after: float (optional)
+            The number of seconds a PING may go unanswered before the connection is declared dead and disconnected.
+            Default value is 90.
+        on_dead: (IRCConnection, float) -> None (optional)
+            A function which is called with the connection and the age of the oldest unanswered PING
+            after the connection has been declared dead.
+            Default value is None.
+        histogram: LagHistogram (optional)
+            The histogram to record round-trip times in.
+            Default value is None, which creates a new histogram.
+        """
+        self.__connection = connection
+        self.__interval = interval
+        self.__dead_after = dead_after
+        self.__on_dead = on_dead
+        self.__histogram = histogram if histogram is not None else LagHistogram()
+        self.__tokens = (f'{KeepAlive.TOKEN_PREFIX}{i}' for i in itertools.count())
+        # Maps the tokens of unanswered pings to the time they were sent, in the order they were sent.
+        self.__pending = {}
+        self.__lag = None
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__thread = None
+        # The tokens of the PINGs to send, taken by the sender thread; None stops it.
+        self.__outgoing = None
+        self.__send_failed = False
+        self.__listener = MessageListener(message_filter=self.__is_pong, receive=self.__on_pong)
+
+    @property
+    def histogram(self):
+        """
+        Returns
+        -------
+        LagHistogram:
+            The histogram of measured round-trip times.
+        """
+        return self.__histogram
+
+    @property
+    def lag(self):
+        """
+        Returns
+        -------
+        float|None:
+            The most recent round-trip time in seconds, or None if no PING has been answered yet.
+        """
+        return self.__lag
+
+    def start(self):
+        """Starts sending PINGs in a background thread. Does nothing if the keepalive is already running."""
+        if self.__thread is not None:
+            return
+        self.__stopped.clear()
+        self.__send_failed = False
+        self.__connection.add_listener(self.__listener)
+        self.__outgoing = queue.Queue()
+        threading.Thread(target=self.__send_pings, args=(self.__outgoing,), daemon=True).start()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Stops sending PINGs."""
+        if self.__thread is None:
+            return
+        self.__stopped.set()
+        if self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self.__thread = None
+        # The sender thread is not joined, since it may be blocked sending to a peer which stopped reading.
+        self.__outgoing.put(None)
+        self.__outgoing = None
+        self.__connection.remove_listener(self.__listener)
+        with self.__lock:
+            self.__pending.clear()
+
+    def __is_pong(self, connection, message):
+        return message.command == Commands.PONG and message.text.startswith(KeepAlive.TOKEN_PREFIX)
+
+    def __on_pong(self, connection, message):
+        received = time.monotonic()
+        with self.__lock:
+            sent = self.__pending.get(message.text)
+            if sent is None:
+                return
+            # The server answers in order, so every older ping is answered (or lost) as well.
+            for token in list(self.__pending):
+                del self.__pending[token]
+                if token == message.text:
+                    break
+        self.__lag = received - sent
+        self.__histogram.record(self.__lag)
+
+    def __run(self):
+        last_ping = None
+        tick = min(self.__interval, self.__dead_after, 4) / 4
+        while not self.__stopped.wait(tick):
+            if not self.__connection.is_connection_alive:
+                continue
+            now = time.monotonic()
+            with self.__lock:
+                oldest = next(iter(self.__pending.values()), None)
+            if self.__send_failed or (oldest is not None and now - oldest >= self.__dead_after):
+                self.__send_failed = False
+                self.__connection.disconnect()
+                if self.__on_dead is not None:
+                    self.__on_dead(self.__connection, now - oldest if oldest is not None else 0.0)
+                with self.__lock:
+                    self.__pending.clear()
+                last_ping = None
+                continue
+            if last_ping is None or now - last_ping >= self.__interval:
+                token = next(self.__tokens)
+                with self.__lock:
+                    self.__pending[token] = now
+                self.__outgoing.put(token)
+                last_ping = now
+
+    def __send_pings(self, outgoing):
+        """Sends the PINGs queued by `__run`, until None is queued."""
+        while True:
+            token = outgoing.get()
+            if token is None:
+                return
+            try:
+                self.__connection.cmd_ping(token)
+            except socket.error:
+                self.__send_failed = True
@@ -0,0 +1,261 @@
+import argparse
+import threading
+import time
+
+from prestige_irc.commands import Commands
+from prestige_irc.connection import MessageListener
+from prestige_irc.fakeserver import FakeIRCServer, create_self_signed_contexts
+from prestige_irc.irc_connection import IRCConnection
+from prestige_irc.keepalive import LagHistogram
+from prestige_irc.replies import Replies
+
+# Finer buckets than the keepalive uses, since delivery over loopback takes micro- to milliseconds.
+LATENCY_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LoadReport(object):
+
+    """The results of a `LoadGenerator` run."""
+
+    def __init__(self, clients, connect_time, sent, expected, received, duration, latency):
+        """
+        Parameters
+        ----------
+        clients: int
+            The number of clients which connected and joined their channel.
+        connect_time: float
+            The number of seconds it took every client to connect and join its channel.
+        sent: int
+            The number of messages sent.
+        expected: int
+            The number of deliveries expected: each message is delivered to every other client in its channel.
+        received: int
+            The number of messages received by the clients.
+        duration: float
+            The number of seconds from the first message sent to the last message received.
+        latency: LagHistogram
+            The time from sending each message to each client receiving it.
+        """
+        self.clients = clients
+        self.connect_time = connect_time
+        self.sent = sent
+        self.expected = expected
+        self.received = received
+        self.duration = duration
+        self.latency = latency
+
+    @property
+    def throughput(self):
+        """
+        Returns
+        -------
+        float:
+            The number of messages received per second, across all clients.
+        """
+        return self.received / self.duration if self.duration else 0.0
+
+    def __str__(self):
+        percentiles = ', '.join(f'p{p}={self.latency.percentile(p) * 1000:.2f}ms' for p in (50, 90, 99)) \
+            if self.latency.count else 'n/a'
+        return f'Clients: {self.clients} (connected and joined in {self.connect_time:.2f}s)' + \
+            f'\r\nSent: {self.sent}' + \
+            f'\r\nReceived: {self.received} of {self.expected}' + \
+            f'\r\nDuration: {self.duration:.2f}s' + \
+            f'\r\nThroughput: {self.throughput:.0f} messages/s' + \
+            f'\r\nLatency: {percentiles}'
+
+
+class LoadGenerator(object):
+
+    """
+    Connects many `IRCConnection` clients to a server, floods their channels with PRIVMSGs,
+    and measures how many messages the clients receive and how long each took to arrive.
+
+    Each message carries the time it was sent, so latency is measured end to end:
+    from `IRCConnection.cmd_privmsg` in one client to the listener of another client.
+    """
+
+    def __init__(self, host, port, clients=100, channels=10, messages_per_client=100, rate=None, message_size=64,
+                 enable_ssl=False, ssl_context=None, senders=32, timeout=30):
+        """
+        Readies the load test; call `run` to perform it.
+
+        Parameters
+        ----------
+        host: str
+            The address of the server.
+        port: int
+            The port of the server.
+        clients: int (optional)
+            The number of clients to connect.
+            Default value is 100.
+        channels: int (optional)
+            The number of channels the clients are spread over.
+            Default value is 10.
+        messages_per_client: int (optional)
+            The number of messages each client sends to its channel.
+            Default value is 100.
+        rate: float (optional)
+            The number of messages each client sends per second.
+            Default value is None, which sends as fast as possible.
+        message_size: int (optional)
+            The length of the text of each message, in characters.
+            Default value is 64.
+        enable_ssl: bool (optional)
+            If the clients should connect with TLS.
+            Default value is False.
+        ssl_context: ssl.SSLContext (optional)
+            The context used for TLS connections.
+            Default value is None.
+        senders: int (optional)
+            The number of threads which send the messages.
+            Default value is 32.
+        timeout: float (optional)
+            The number of seconds to wait for the clients to join, and then for the messages to arrive.
+            Default value is 30.
+        """
+        self.__host = host
+        self.__port = port
+        self.__client_count = clients
+        self.__channel_count = max(1, min(channels, clients))
+        self.__messages_per_client = messages_per_client
+        self.__rate = rate
+        self.__message_size = message_size
+        self.__enable_ssl = enable_ssl
+        self.__ssl_context = ssl_context
+        self.__senders = max(1, senders)
+        self.__timeout = timeout
+        self.__lock = threading.Lock()
+        self.__received = 0
+        self.__last_received = 0.0
+        self.__latency = LagHistogram(bounds=LATENCY_BOUNDS)
+
+    def run(self):
+        """
+        Performs the load test, disconnecting every client afterwards.
+
+        Returns
+        -------
+        LoadReport:
+            The results of the load test.
+        """
+        joined = threading.Semaphore(0)
+        connections = []
+        start = time.perf_counter()
+        try:
+            for i in range(self.__client_count):
+                channel = f'#load{i % self.__channel_count}'
+                connection = IRCConnection(nick=f'load{i}', capabilities=(), channels=[channel])
+                connection.add_listener(MessageListener(message_filter=LoadGenerator.__is_own_join,
+                                                        receive=lambda conn, msg: joined.release()))
+                connection.add_listener(MessageListener(message_filter=LoadGenerator.__is_load_message,
+                                                        receive=self.__on_message))
+                if connection.connect(self.__host, self.__port, timeout=self.__timeout,
+                                      enable_ssl=self.__enable_ssl, ssl_context=self.__ssl_context):
+                    connections.append((connection, channel))
+            deadline = time.monotonic() + self.__timeout
+            for _ in connections:
+                if not joined.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                    break
+            connect_time = time.perf_counter() - start
+
+            members = {}
+            for _, channel in connections:
+                members[channel] = members.get(channel, 0) + 1
+            expected = sum((members[channel] - 1) * self.__messages_per_client for _, channel in connections)
+
+            start = time.perf_counter()
+            sent = self.__send_all(connections)
+            deadline = time.monotonic() + self.__timeout
+            while self.__received < expected and time.monotonic() < deadline:
+                time.sleep(0.01)
+            duration = (self.__last_received or time.perf_counter()) - start
+            return LoadReport(clients=len(connections), connect_time=connect_time, sent=sent, expected=expected,
+                              received=self.__received, duration=duration, latency=self.__latency)
+        finally:
+            for connection, _ in connections:
+                connection.disconnect()
+
+    def __send_all(self, connections):
+        """Sends the messages of every client from the sender threads, and returns the number of messages sent."""
+        counts = [0] * self.__senders
+        padding = 'x' * self.__message_size
+
+        def send(index):
+            assigned = connections[index::self.__senders]
+            interval = 1 / self.__rate if self.__rate else 0
+            started = time.perf_counter()
+            for n in range(self.__messages_per_client):
+                if interval:
+                    delay = started + n * interval - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                for connection, channel in assigned:
+                    # The send time, in nanoseconds, precedes the padding.
+                    text = f'{time.perf_counter_ns()} {padding}'[:max(self.__message_size, 20)]
+                    connection.cmd_privmsg(target=channel, message=text)
+                    counts[index] += 1
+
+        threads = [threading.Thread(target=send, args=(i,)) for i in range(min(self.__senders, len(connections)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(counts)
+
+    @staticmethod
+    def __is_own_join(connection, message):
+        return message.command == Replies.RPL_ENDOFNAMES
+
+    @staticmethod
+    def __is_load_message(connection, message):
+        return message.command == Commands.PRIVMSG and message.nick.startswith('load')
+
+    def __on_message(self, connection, message):
+        received = time.perf_counter_ns()
+        try:
+            sent = int(message.text.split(' ', 1)[0])
+        except ValueError:
+            return
+        self.__latency.record((received - sent) / 1e9)
+        with self.__lock:
+            self.__received += 1
+            self.__last_received = received / 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test IRCConnection against a fake or real IRC server.')
+    parser.add_argument('--host', help='the server to connect to; a FakeIRCServer is started if omitted')
+    parser.add_argument('--port', type=int, default=6667)
+    parser.add_argument('--ssl', action='store_true', help='connect with TLS, using a self-signed certificate '
+                                                           'when a FakeIRCServer is started')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--channels', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=100, help='the number of messages each client sends')
+    parser.add_argument('--rate', type=float, help='the number of messages each client sends per second')
+    parser.add_argument('--size', type=int, default=64, help='the length of each message')
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    server = None
+    host, port, client_context = args.host, args.port, None
+    if host is None:
+        server_context = None
+        if args.ssl:
+            server_context, client_context = create_self_signed_contexts()
+        server = FakeIRCServer(host='127.0.0.1', ssl_context=server_context)
+        server.start()
+        host, port = server.address
+        host = 'localhost' if args.ssl else host
+    try:
+        report = LoadGenerator(host=host, port=port, clients=args.clients, channels=args.channels,
+                               messages_per_client=args.messages, rate=args.rate, message_size=args.size,
+                               enable_ssl=args.ssl, ssl_context=client_context, timeout=args.timeout).run()
+        print(report)
+    finally:
+        if server is not None:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,141 @@
+import datetime
+
+from prestige_irc.commands import Commands
+
+# The maximum length of a line sent to the server, including CR-LF.
+MAX_LINE_LENGTH = 512
+
+# The characters channel names start with.
+CHANNEL_PREFIXES = '#&+!'
+
+_UPPER = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_LOWER = 'abcdefghijklmnopqrstuvwxyz'
+
+# Lowercase translation tables for the values of the CASEMAPPING token in RPL_ISUPPORT.
+CASEMAPPINGS = {
+    'ascii': str.maketrans(_UPPER, _LOWER),
+    'rfc1459': str.maketrans(_UPPER + '[]\\~', _LOWER + '{}|^'),
+    'strict-rfc1459': str.maketrans(_UPPER + '[]\\', _LOWER + '{}|'),
+}
+
+_TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+
+def irc_lower(text, casemapping='rfc1459'):
+    """Lowercases `text` according to an IRC casemapping.
+
+    Parameters
+    ----------
+    text: str
+        The text to lowercase.
+    casemapping: str (optional)
+        The casemapping advertised by the server in RPL_ISUPPORT: 'ascii', 'rfc1459' or 'strict-rfc1459'.
+        Unknown casemappings are treated as 'rfc1459'.
+        Default value is 'rfc1459'.
+
+    Returns
+    -------
+    str:
+        The lowercased text.
+    """
+    return text.translate(CASEMAPPINGS.get(casemapping, CASEMAPPINGS['rfc1459']))
+
+
+def parse_tags(raw_tags):
+    """Breaks the IRCv3 message tags of a message into a dictionary.
+
+    Parameters
+    ----------
+    raw_tags: str
+        The tags of the message, without the leading `@`, e.g. `time=2020-01-01T00:00:00.000Z;msgid=abc`.
+
+    Returns
+    -------
+    dict:
+        The tag values by tag name, unescaped. Tags without a value have an empty string as their value.
+    """
+    tags = {}
+    for tag in raw_tags.split(';'):
+        if not tag:
+            continue
+        key, _, value = tag.partition('=')
+        tags[key] = _unescape_tag_value(value) if '\\' in value else value
+    return tags
+
+
+def _unescape_tag_value(value):
+    chars = []
+    escaped = False
+    for char in value:
+        if escaped:
+            chars.append(_TAG_ESCAPES.get(char, char))
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        else:
+            chars.append(char)
+    return ''.join(chars)
+
+
+def parse_ctcp(text):
+    """Decodes a CTCP payload, e.g. `\x01VERSION\x01` or `\x01ACTION waves\x01`.
+
+    Parameters
+    ----------
+    text: str
+        The text of a PRIVMSG or NOTICE.
+
+    Returns
+    -------
+    tuple|None:
+        The uppercased CTCP command and its parameters, or None if `text` is not a CTCP payload.
+    """
+    if len(text) < 2 or text[0] != '\x01':
+        return None
+    # The closing delimiter is optional, since some clients leave it out.
+    payload = text[1:-1] if text[-1] == '\x01' else text[1:]
+    command, _, params = payload.partition(' ')
+    if not command:
+        return None
+    return command.upper(), params
+
+
+def chunk_targets(prefix, targets, separator):
+    """Splits targets into groups which fit on a single line after `prefix`.
+
+    Parameters
+    ----------
+    prefix: str
+        The start of the line, e.g. 'ISON '.
+    targets: collections.iterable
+        The targets to split up.
+    separator: str
+        The separator of the targets on the line.
+
+    Returns
+    -------
+    list:
+        Lists of targets, each of which fits on a line of at most `MAX_LINE_LENGTH` bytes.
+    """
+    chunks, chunk, length = [], [], len(prefix.encode('utf-8')) + 2
+    for target in targets:
+        size = len(target.encode('utf-8')) + (len(separator) if chunk else 0)
+        if chunk and length + size > MAX_LINE_LENGTH:
+            chunks.append(chunk)
+            chunk, length = [], len(prefix.encode('utf-8')) + 2
+            size = len(target.encode('utf-8'))
+        chunk.append(target)
+        length += size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
 def parse(raw_message):
     """Breaks a message from an IRC server into components.
 
+    IRCv3 message tags at the start of the message are skipped; see `parse_tags`.
+
     Parameters
     ----------
     raw_message: str
@@ -24,6 +159,8 @@ def parse(raw_message):
     host = ''
     if not raw_message:
         raise Exception('Cannot parse an empty message.')
+    if raw_message[0] == '@':
+        raw_message = raw_message.split(' ', 1)[1]
     if raw_message[0] == ':':
         host, raw_message = raw_message[1:].split(' ', 1)
     if raw_message.find(' :') != -1:
@@ -40,9 +177,141 @@ def parse(raw_message):
     return nick, host, command, target, text, args
 
 
+def parse_many(buffer, columnar=False, encoding='utf-8'):
+    """Breaks a chunk of CR-LF delimited bytes from an IRC server into messages in a single pass.
+
+    The complete lines in `buffer` are parsed with the same rules as `parse`, without building an intermediate tuple
+    per line, and each message keeps the bytes of its line as `raw_bytes`. Bytes which cannot be decoded are replaced.
+    Empty lines, and malformed lines without a command (e.g. only tags or a prefix), are skipped, so one bad line
+    does not cost the others of the chunk.
+    Any bytes after the last CR-LF are an incomplete message, and are returned untouched so they can be
+    prepended to the next chunk received.
+
+    Parameters
+    ----------
+    buffer: bytes
+        The bytes received from the IRC server.
+    columnar: bool (optional)
+        If the messages should be returned as a `MessageColumns` object of parallel lists,
+        instead of a list of `IRCMessage` objects.
+        Default value is False.
+    encoding: str (optional)
+        The encoding used to decode the messages.
+        Default value is 'utf-8'.
+
+    Returns
+    -------
+    messages: list|MessageColumns
+        The messages parsed from the complete lines of `buffer`.
+    remainder: bytes
+        The bytes following the last CR-LF in `buffer`.
+    """
+    columns = MessageColumns() if columnar else None
+    messages = []
+    end = buffer.rfind(b'\r\n')
+    if end == -1:
+        return (columns if columnar else messages), buffer
+
+    new_message = IRCMessage.__new__
+    for line in buffer[:end].split(b'\r\n'):
+        if not line:
+            continue
+        raw_message = line.decode(encoding, 'replace')
+        host = ''
+        tags = {}
+        rest = raw_message
+        if rest[0] == '@':
+            raw_tags, _, rest = rest[1:].partition(' ')
+            tags = parse_tags(raw_tags)
+        if rest[:1] == ':':
+            host, _, rest = rest[1:].partition(' ')
+        trailing_start = rest.find(' :')
+        if trailing_start != -1:
+            args = rest[:trailing_start].split()
+            args.append(rest[trailing_start + 2:])
+        else:
+            args = rest.split()
+        if not args or not args[0]:
+            continue
+        command = args.pop(0)
+        bang = host.find('!')
+        nick = host[:bang] if bang != -1 else ''
+        if args:
+            target, text = args[0], args[-1]
+        else:
+            target = text = ''
+
+        if columnar:
+            columns.append(raw_message, line, tags, nick, host, command, target, text, args)
+        else:
+            message = new_message(IRCMessage)
+            message.raw, message.raw_bytes, message.tags = raw_message, line, tags
+            message.nick, message.host, message.command = nick, host, command
+            message.target, message.text, message.args = target, text, args
+            messages.append(message)
+
+    return (columns if columnar else messages), buffer[end + 2:]
+
+
+class MessageColumns(object):
+
+    """
+    Messages parsed by `parse_many`, stored as parallel lists of their fields.
+
+    The element at the same index of each list belongs to the same message,
+    so messages can be filtered by a single field without creating an `IRCMessage` for each line.
+    """
+
+    def __init__(self):
+        """Creates empty columns."""
+        self.raws = []
+        self.raw_bytes = []
+        self.tags = []
+        self.nicks = []
+        self.hosts = []
+        self.commands = []
+        self.targets = []
+        self.texts = []
+        self.args = []
+
+    def __len__(self):
+        return len(self.raws)
+
+    def append(self, raw_message, raw_bytes, tags, nick, host, command, target, text, args):
+        """Adds the fields of a message to the end of the columns."""
+        self.raws.append(raw_message)
+        self.raw_bytes.append(raw_bytes)
+        self.tags.append(tags)
+        self.nicks.append(nick)
+        self.hosts.append(host)
+        self.commands.append(command)
+        self.targets.append(target)
+        self.texts.append(text)
+        self.args.append(args)
+
+    def message(self, index):
+        """
+        Creates an `IRCMessage` from the fields of the message at `index`, without parsing it again.
+
+        Parameters
+        ----------
+        index: int
+            The index of the message in the columns.
+
+        Returns
+        -------
+        IRCMessage:
+            The message at `index`.
+        """
+        return IRCMessage.from_fields(raw_message=self.raws[index], nick=self.nicks[index], host=self.hosts[index],
+                                      command=self.commands[index], target=self.targets[index],
+                                      text=self.texts[index], args=self.args[index], tags=self.tags[index],
+                                      raw_bytes=self.raw_bytes[index])
+
+
 class IRCMessage(object):
 
-    def __init__(self, raw_message):
+    def __init__(self, raw_message, raw_bytes=None):
         """
         Parses the raw string received from the server and
         separates each piece into a field using IRC.parse(raw_message).
@@ -51,11 +320,105 @@ class IRCMessage(object):
         ----------
         raw_message: str
             The raw string received from the server.
+        raw_bytes: bytes (optional)
+            The bytes `raw_message` was decoded from, kept so the message can be stored or forwarded
+            without encoding it again.
+            Default value is None.
         """
         # Parse the raw message.
         self.raw = raw_message
+        self.raw_bytes = raw_bytes
+        self.tags = {}
+        if raw_message[:1] == '@':
+            raw_tags, raw_message = raw_message[1:].split(' ', 1)
+            self.tags = parse_tags(raw_tags)
         self.nick, self.host, self.command, self.target, self.text, self.args = parse(raw_message)
 
+    @classmethod
+    def from_fields(cls, raw_message, nick, host, command, target, text, args, tags=None, raw_bytes=None):
+        """
+        Creates a message from fields which have already been parsed, e.g. by `parse_many`.
+
+        Parameters
+        ----------
+        raw_message: str
+            The raw string received from the server.
+        nick: str
+            The nick name of the sender.
+        host: str
+            The host of the IRC message (nick!user@host).
+        command: str
+            The IRC command.
+        target: str
+            The target to which the message was sent.
+        text: str
+            The text sent (the last value in `args`).
+        args: list
+            The arguments in the IRC message.
+        tags: dict (optional)
+            The IRCv3 message tags of the message.
+            Default value is None, which is the same as no tags.
+        raw_bytes: bytes (optional)
+            The bytes `raw_message` was decoded from.
+            Default value is None.
+
+        Returns
+        -------
+        IRCMessage:
+            The message with the given fields.
+        """
+        message = cls.__new__(cls)
+        message.raw = raw_message
+        message.raw_bytes = raw_bytes
+        message.tags = tags if tags is not None else {}
+        message.nick, message.host, message.command = nick, host, command
+        message.target, message.text, message.args = target, text, args
+        return message
+
+    @property
+    def encoded(self):
+        """
+        Gets the message as bytes, e.g. to store or forward it.
+
+        Returns
+        -------
+        bytes:
+            `raw_bytes` if the bytes the message was decoded from were kept, otherwise `raw` encoded as UTF-8.
+        """
+        return self.raw_bytes if self.raw_bytes is not None else self.raw.encode('utf-8')
+
+    @property
+    def time(self):
+        """
+        Gets the time the server received the message, from the IRCv3 `server-time` tag.
+
+        Returns
+        -------
+        float|None:
+            The number of seconds since the epoch, or None if the message has no valid `time` tag.
+        """
+        value = self.tags.get('time')
+        if not value:
+            return None
+        try:
+            return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            return None
+
+    @property
+    def ctcp(self):
+        """
+        Decodes the CTCP payload of a PRIVMSG (a request) or NOTICE (a reply); see `parse_ctcp`.
+
+        Returns
+        -------
+        tuple|None:
+            The uppercased CTCP command and its parameters, or None if the message does not carry CTCP.
+        """
+        if self.command not in (Commands.PRIVMSG, Commands.NOTICE) or not self.text:
+            return None
+        return parse_ctcp(self.text)
+
     def __str__(self):
         return 'Raw: ' + self.raw + \
             '\r\nNick: ' + str(self.nick) + \
@@ -63,4 +426,31 @@ class IRCMessage(object):
             '\r\nCommand: ' + str(self.command) + \
             '\r\nTarget: ' + str(self.target) + \
             '\r\nText: ' + str(self.text) + \
-            '\r\nArgs: ' + str(self.args)
+            '\r\nArgs: ' + str(self.args) + \
+            '\r\nTags: ' + str(self.tags)
+
+
+class IRCBatch(IRCMessage):
+
+    """
+    An IRCv3 batch: the messages sent between a `BATCH +reference` and a `BATCH -reference` message,
+    delivered together as a single message.
+
+    The fields inherited from `IRCMessage` are those of the `BATCH +reference` message which opened the batch.
+    """
+
+    def __init__(self, raw_message):
+        """
+        Creates an empty batch from the message which opened it.
+
+        Parameters
+        ----------
+        raw_message: str
+            The raw `BATCH +reference type [params...]` message received from the server.
+        """
+        super().__init__(raw_message)
+        self.reference = self.target[1:]
+        self.type = self.args[1] if len(self.args) > 1 else ''
+        self.params = self.args[2:]
+        # The messages in the batch, in the order they were received. Nested batches are included as `IRCBatch`es.
+        self.messages = []
@@ -0,0 +1,283 @@
+import os
+import sys
+import threading
+import time
+
+
+class ListenerStats(object):
+
+    """The execution times of a single listener, as measured by a `ListenerMonitor`."""
+
+    def __init__(self):
+        """Creates empty statistics."""
+        self.calls = 0
+        self.slow_calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.max_wall_time = 0.0
+
+    def copy(self):
+        """
+        Returns
+        -------
+        ListenerStats:
+            A copy of the statistics.
+        """
+        stats = ListenerStats()
+        stats.calls, stats.slow_calls = self.calls, self.slow_calls
+        stats.wall_time, stats.cpu_time, stats.max_wall_time = self.wall_time, self.cpu_time, self.max_wall_time
+        return stats
+
+    @property
+    def mean_wall_time(self):
+        """
+        Returns
+        -------
+        float:
+            The mean number of seconds a call took, or 0 if the listener has not been called.
+        """
+        return self.wall_time / self.calls if self.calls else 0.0
+
+    @property
+    def mean_cpu_time(self):
+        """
+        Returns
+        -------
+        float:
+            The mean number of seconds of CPU time a call used, or 0 if the listener has not been called.
+        """
+        return self.cpu_time / self.calls if self.calls else 0.0
+
+
+class _Call(object):
+
+    """A listener call in progress."""
+
+    def __init__(self, listener, started):
+        self.listener = listener
+        self.started = started
+        self.flagged = False
+
+
+class ListenerMonitor(object):
+
+    """
+    Times every listener call of the connections it is set on with `Connection.set_listener_monitor`,
+    flags listeners which exceed a latency budget, and can quarantine them so they are no longer called.
+
+    Calls are timed with both wall-clock time and the CPU time of the dispatching thread, so a listener which blocks
+    (e.g. on an HTTP request) can be told apart from one which computes.
+    A watchdog thread flags calls which are still running past the budget, so listeners which never return are
+    caught too, and an on-demand sampling profiler attributes time inside listeners to the code running there.
+    """
+
+    def __init__(self, budget=1.0, on_slow=None, quarantine_after=None):
+        """
+        Creates the monitor; call `start` to run the watchdog.
+
+        Parameters
+        ----------
+        budget: float (optional)
+            The number of seconds a listener call may take before it is considered slow.
+            Default value is 1.0.
+        on_slow: (object, float, bool) -> None (optional)
+            A function which is called with the listener, the number of seconds the call has taken so far,
+            and if the call has finished, when a call exceeds the budget.
+            It is called at most once per call: by the watchdog while the call is running, or after it finishes.
+            Default value is None.
+        quarantine_after: int (optional)
+            The number of slow calls after which a listener is quarantined; see `quarantined`.
+            Default value is None, which never quarantines listeners.
+        """
+        self.__budget = budget
+        self.__on_slow = on_slow
+        self.__quarantine_after = quarantine_after
+        self.__stats = {}
+        self.__quarantined = set()
+        # Maps the identifiers of threads which are calling a listener to the call.
+        self.__calls = {}
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__watchdog = None
+        self.__samples = None
+        self.__sampling = threading.Event()
+        self.__sampler = None
+
+    @property
+    def stats(self):
+        """
+        Returns
+        -------
+        dict:
+            A copy of the `ListenerStats` of each listener which has been called.
+        """
+        with self.__lock:
+            return {listener: stats.copy() for listener, stats in self.__stats.items()}
+
+    @property
+    def quarantined(self):
+        """
+        Returns
+        -------
+        frozenset:
+            The listeners which have been quarantined, and are no longer called.
+        """
+        with self.__lock:
+            return frozenset(self.__quarantined)
+
+    def quarantine(self, listener):
+        """
+        Stops calling `listener`, without removing it from its connections.
+
+        Parameters
+        ----------
+        listener: MessageListener
+            The listener to quarantine.
+        """
+        with self.__lock:
+            self.__quarantined.add(listener)
+
+    def release(self, listener):
+        """
+        Resumes calling a quarantined listener, and resets its count of slow calls.
+
+        Parameters
+        ----------
+        listener: MessageListener
+            The listener to release.
+        """
+        with self.__lock:
+            self.__quarantined.discard(listener)
+            stats = self.__stats.get(listener)
+            if stats is not None:
+                stats.slow_calls = 0
+
+    def run(self, connection, listener, message):
+        """
+        Calls `listener` with `message` as `Connection` would, timing the call.
+
+        Parameters
+        ----------
+        connection: Connection
+            The connection the message was received over.
+        listener: MessageListener
+            The listener to call.
+        message: object
+            The message to pass to the listener.
+        """
+        if listener in self.__quarantined:
+            return
+        thread = threading.get_ident()
+        call = _Call(listener, time.perf_counter())
+        cpu_started = time.thread_time()
+        with self.__lock:
+            self.__calls[thread] = call
+        try:
+            if listener.accept(connection=connection, message=message):
+                listener.receive(connection=connection, message=message)
+        finally:
+            wall_time = time.perf_counter() - call.started
+            cpu_time = time.thread_time() - cpu_started
+            with self.__lock:
+                del self.__calls[thread]
+                stats = self.__stats.get(listener)
+                if stats is None:
+                    stats = self.__stats[listener] = ListenerStats()
+                stats.calls += 1
+                stats.wall_time += wall_time
+                stats.cpu_time += cpu_time
+                stats.max_wall_time = max(stats.max_wall_time, wall_time)
+                report = wall_time > self.__budget and not call.flagged
+                if report:
+                    self.__flag(call)
+            if report and self.__on_slow is not None:
+                self.__on_slow(listener, wall_time, True)
+
+    def __flag(self, call):
+        """Counts a slow call, and quarantines its listener if it has too many. Must be called holding the lock."""
+        call.flagged = True
+        stats = self.__stats.get(call.listener)
+        if stats is None:
+            stats = self.__stats[call.listener] = ListenerStats()
+        stats.slow_calls += 1
+        if self.__quarantine_after is not None and stats.slow_calls >= self.__quarantine_after:
+            self.__quarantined.add(call.listener)
+
+    def start(self):
+        """Starts the watchdog thread, which flags calls that are still running past the budget."""
+        if self.__watchdog is not None:
+            return
+        self.__stopped.clear()
+        self.__watchdog = threading.Thread(target=self.__watch, daemon=True)
+        self.__watchdog.start()
+
+    def stop(self):
+        """Stops the watchdog thread and the profiler."""
+        self.stop_profiling()
+        if self.__watchdog is None:
+            return
+        self.__stopped.set()
+        self.__watchdog.join()
+        self.__watchdog = None
+
+    def __watch(self):
+        while not self.__stopped.wait(self.__budget / 4):
+            now = time.perf_counter()
+            with self.__lock:
+                late = [call for call in self.__calls.values()
+                        if not call.flagged and now - call.started > self.__budget]
+                for call in late:
+                    self.__flag(call)
+            if self.__on_slow is not None:
+                for call in late:
+                    self.__on_slow(call.listener, now - call.started, False)
+
+    def start_profiling(self, interval=0.005):
+        """
+        Starts sampling what each running listener call is executing.
+
+        Parameters
+        ----------
+        interval: float (optional)
+            The number of seconds between samples.
+            Default value is 0.005.
+        """
+        if self.__sampler is not None:
+            return
+        self.__samples = {}
+        self.__sampling.clear()
+        self.__sampler = threading.Thread(target=self.__sample, args=(interval,), daemon=True)
+        self.__sampler.start()
+
+    def stop_profiling(self):
+        """
+        Stops sampling.
+
+        Returns
+        -------
+        dict:
+            For each listener which was sampled, a dictionary which maps the innermost location executing in its calls,
+            formatted as 'file:line (function)', to the number of samples taken there.
+            The number of samples of a listener is proportional to the time spent in its calls.
+            Returns an empty dictionary if the profiler was not running.
+        """
+        if self.__sampler is None:
+            return {}
+        self.__sampling.set()
+        self.__sampler.join()
+        self.__sampler = None
+        return self.__samples
+
+    def __sample(self, interval):
+        while not self.__sampling.wait(interval):
+            with self.__lock:
+                calls = [(thread, call.listener) for thread, call in self.__calls.items()]
+            frames = sys._current_frames()
+            for thread, listener in calls:
+                frame = frames.get(thread)
+                if frame is None:
+                    continue
+                code = frame.f_code
+                location = f'{os.path.basename(code.co_filename)}:{frame.f_lineno} ({code.co_name})'
+                locations = self.__samples.setdefault(listener, {})
+                locations[location] = locations.get(location, 0) + 1
@@ -0,0 +1,167 @@
+import concurrent.futures
+import threading
+
+from prestige_irc.connection import MessageListener
+from prestige_irc.message import IRCMessage
+
+
+def _handle_batch(handler, raw_messages):
+    """
+    Runs in a worker process: parses each raw message and collects the lines `handler` returns for it.
+
+    Parameters
+    ----------
+    handler: (IRCMessage) -> str|collections.iterable|None
+        The handler passed to `OffloadListener`.
+    raw_messages: list
+        The raw strings of the messages.
+
+    Returns
+    -------
+    list:
+        The lines to send, in the order of the messages.
+    """
+    lines = []
+    for raw_message in raw_messages:
+        result = handler(IRCMessage(raw_message))
+        if result is None:
+            continue
+        if isinstance(result, str):
+            lines.append(result)
+        else:
+            lines.extend(result)
+    return lines
+
+
+class OffloadListener(MessageListener):
+
+    """
+    A listener which runs a CPU-bound handler in a pool of worker processes, so it is not limited by the GIL
+    and does not slow down the listeners of the connection.
+
+    Only the raw string of each message is sent to the workers, where it is parsed again into an `IRCMessage`.
+    Messages are batched per connection, so a single round trip to a worker handles many messages,
+    and the number of batches being handled at once is bounded; once the bound is reached, the listener blocks
+    until a batch finishes. The lines the handler returns are sent back over the connection the messages came from.
+    Lines of different batches may be sent out of order when more than one batch is in flight.
+    """
+
+    def __init__(self, handler, message_filter=None, executor=None, max_workers=None, batch_size=64,
+                 batch_interval=0.02, max_in_flight=8, on_error=None):
+        """
+        Readies the listener; call `start` before adding it with `Connection.add_listener`.
+
+        Parameters
+        ----------
+        handler: (IRCMessage) -> str|collections.iterable|None
+            A function which is called in a worker process with each accepted message, and returns a line
+            or lines to send over the connection (e.g. 'PRIVMSG #channel :reply'), or None.
+            It must be picklable, i.e. defined at the top level of a module.
+        message_filter: (Connection, IRCMessage) -> bool (optional)
+            A method which returns if a message should be handled; it runs in the listener thread, so it should
+            be cheap, and filter out as many messages as possible before they are sent to the workers.
+            Default value is None, which accepts every message.
+        executor: concurrent.futures.Executor (optional)
+            The pool to run the handler in, which may be shared with other listeners; it is not shut down by `stop`.
+            Default value is None, which creates a `ProcessPoolExecutor` on `start`.
+        max_workers: int (optional)
+            The number of processes of the created pool.
+            Default value is None, which uses the number of processors.
+        batch_size: int (optional)
+            The number of messages of a connection which are sent to a worker at once.
+            Default value is 64.
+        batch_interval: float (optional)
+            The maximum number of seconds a message waits for its batch to fill up.
+            Default value is 0.02.
+        max_in_flight: int (optional)
+            The maximum number of batches being handled at once.
+            Default value is 8.
+        on_error: (Connection, Exception) -> None (optional)
+            A function which is called when the handler raises an exception, or the lines cannot be sent.
+            Default value is None, which prints the exception.
+        """
+        super().__init__(receive=self.__enqueue, message_filter=message_filter)
+        self.__handler = handler
+        self.__executor = executor
+        self.__owns_executor = executor is None
+        self.__max_workers = max_workers
+        self.__batch_size = batch_size
+        self.__batch_interval = batch_interval
+        self.__max_in_flight = max_in_flight
+        self.__in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.__on_error = on_error
+        # The raw messages waiting to be sent to a worker, by connection.
+        self.__pending = {}
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        """Creates the pool if needed, and starts sending partial batches every `batch_interval`."""
+        if self.__thread is not None:
+            return
+        if self.__executor is None:
+            self.__executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.__max_workers)
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Sends the pending messages, waits for every batch to be handled, and shuts down the created pool."""
+        if self.__thread is None:
+            return
+        self.__stopped.set()
+        self.__thread.join()
+        self.__thread = None
+        self.flush()
+        # Every batch has been handled once all of the in-flight slots are free.
+        for _ in range(self.__max_in_flight):
+            self.__in_flight.acquire()
+        for _ in range(self.__max_in_flight):
+            self.__in_flight.release()
+        if self.__owns_executor:
+            self.__executor.shutdown()
+            self.__executor = None
+
+    def flush(self):
+        """Sends the pending messages of every connection to the workers, without waiting for their batches to fill."""
+        with self.__lock:
+            pending, self.__pending = self.__pending, {}
+        for connection, raw_messages in pending.items():
+            self.__submit(connection, raw_messages)
+
+    def __enqueue(self, connection, message):
+        with self.__lock:
+            batch = self.__pending.setdefault(connection, [])
+            batch.append(message.raw)
+            if len(batch) < self.__batch_size:
+                return
+            del self.__pending[connection]
+        self.__submit(connection, batch)
+
+    def __submit(self, connection, raw_messages):
+        self.__in_flight.acquire()
+        try:
+            future = self.__executor.submit(_handle_batch, self.__handler, raw_messages)
+        except Exception:
+            self.__in_flight.release()
+            raise
+        future.add_done_callback(lambda done: self.__on_done(connection, done))
+
+    def __on_done(self, connection, future):
+        try:
+            lines = future.result()
+            if lines:
+                # Sent with a single write, like the batch was received.
+                connection.send_data(''.join(f'{line}\r\n' for line in lines).encode('utf-8'))
+        except Exception as err:
+            if self.__on_error is not None:
+                self.__on_error(connection, err)
+            else:
+                print(f'Caught exception in offloaded handler:\n{str(err)}')
+        finally:
+            self.__in_flight.release()
+
+    def __run(self):
+        while not self.__stopped.wait(self.__batch_interval):
+            self.flush()
@@ -0,0 +1,289 @@
+import collections
+import threading
+
+from prestige_irc.commands import Commands
+from prestige_irc.message import chunk_targets, irc_lower
+from prestige_irc.replies import Replies
+
+
+class PresenceTracker(object):
+
+    """
+    Tracks which of a list of nicknames are online, and calls a function whenever one of them connects or disconnects.
+
+    When the server supports MONITOR or WATCH (as advertised in RPL_ISUPPORT), the nicknames are subscribed to once
+    and the server notifies the connection of every change, so no traffic is needed while nothing changes.
+    Otherwise, and for nicknames beyond the server's MONITOR or WATCH limit, the nicknames are polled with ISON
+    in as few lines as possible.
+    """
+
+    MONITOR = 'MONITOR'
+    WATCH = 'WATCH'
+    ISON = 'ISON'
+
+    def __init__(self, connection, nicks=(), on_change=None, poll_interval=60):
+        """
+        Readies the tracker for `connection`; call `start` to begin tracking.
+
+        Parameters
+        ----------
+        connection: IRCConnection
+            The connection to track the nicknames over.
+        nicks: collections.iterable (optional)
+            The nicknames to track.
+            Default value is an empty tuple.
+        on_change: (str, bool) -> None (optional)
+            A function which is called with a nickname and if it is online whenever its presence becomes known
+            or changes. It is called on the listen thread of the connection, so it should return quickly.
+            Default value is None.
+        poll_interval: float (optional)
+            The number of seconds between ISON polls of the nicknames which cannot be subscribed to.
+            Default value is 60.
+        """
+        self.__connection = connection
+        self.__on_change = on_change
+        self.__poll_interval = poll_interval
+        self.__casemapping = 'rfc1459'
+        self.__mode = None
+        # The tracked nicknames as they were added, by their lowercased form.
+        self.__nicks = {irc_lower(nick): nick for nick in nicks}
+        # If each tracked nickname is online, by lowercased nickname; unknown presences are missing.
+        self.__online = {}
+        # The nicknames subscribed to with MONITOR or WATCH, and the nicknames which are polled with ISON.
+        self.__subscribed = set()
+        self.__polled = set()
+        # The ISON chunks which have been sent and not answered yet, oldest first.
+        self.__pending_chunks = collections.deque()
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    @property
+    def mode(self):
+        """
+        Returns
+        -------
+        str|None:
+            `PresenceTracker.MONITOR`, `PresenceTracker.WATCH` or `PresenceTracker.ISON`,
+            or None if the connection has not finished registering yet.
+        """
+        return self.__mode
+
+    @property
+    def online(self):
+        """
+        Returns
+        -------
+        frozenset:
+            The tracked nicknames which are online, as they were added.
+        """
+        with self.__lock:
+            return frozenset(self.__nicks[lower] for lower, online in self.__online.items() if online)
+
+    def is_online(self, nick):
+        """
+        Checks if a tracked nickname is online, according to the latest notification or poll.
+
+        Parameters
+        ----------
+        nick: str
+            The nickname.
+
+        Returns
+        -------
+        bool|None:
+            If the nickname is online, or None if its presence is not known yet or it is not tracked.
+        """
+        with self.__lock:
+            return self.__online.get(self.__fold(nick))
+
+    def start(self):
+        """Starts tracking. Does nothing if the tracker is already running."""
+        if self.__thread is not None:
+            return
+        self.__stopped.clear()
+        self.__connection.add_processor(self.__process)
+        self.__thread = threading.Thread(target=self.__poll, daemon=True)
+        self.__thread.start()
+        # A connection which has received RPL_ISUPPORT has already registered.
+        if self.__connection.is_connection_alive and self.__connection.isupport:
+            self.__subscribe_all()
+
+    def stop(self):
+        """Stops tracking, and removes the subscriptions from the server."""
+        if self.__thread is None:
+            return
+        self.__stopped.set()
+        self.__thread.join()
+        self.__thread = None
+        self.__connection.remove_processor(self.__process)
+        with self.__lock:
+            subscribed, mode = sorted(self.__nicks[lower] for lower in self.__subscribed), self.__mode
+            self.__subscribed.clear()
+            self.__polled.clear()
+            self.__pending_chunks.clear()
+            self.__mode = None
+        if subscribed and self.__connection.is_connection_alive:
+            self.__unsubscribe(mode, subscribed)
+
+    def add(self, nicks):
+        """
+        Starts tracking nicknames.
+
+        Parameters
+        ----------
+        nicks: collections.iterable
+            The nicknames to track.
+        """
+        with self.__lock:
+            added = []
+            for nick in nicks:
+                lower = self.__fold(nick)
+                if lower not in self.__nicks:
+                    self.__nicks[lower] = nick
+                    added.append(nick)
+            mode = self.__mode
+        if added and mode is not None:
+            self.__subscribe(mode, added)
+
+    def remove(self, nicks):
+        """
+        Stops tracking nicknames.
+
+        Parameters
+        ----------
+        nicks: collections.iterable
+            The nicknames to stop tracking.
+        """
+        with self.__lock:
+            removed = []
+            for nick in nicks:
+                lower = self.__fold(nick)
+                if self.__nicks.pop(lower, None) is None:
+                    continue
+                self.__online.pop(lower, None)
+                self.__polled.discard(lower)
+                if lower in self.__subscribed:
+                    self.__subscribed.discard(lower)
+                    removed.append(nick)
+            mode = self.__mode
+        if removed:
+            self.__unsubscribe(mode, removed)
+
+    def __fold(self, nick):
+        return irc_lower(nick, self.__casemapping)
+
+    def __subscribe_all(self):
+        """Chooses how to track the nicknames from the server's features, and subscribes to every nickname."""
+        isupport = self.__connection.isupport
+        with self.__lock:
+            self.__casemapping = isupport.get('CASEMAPPING') or 'rfc1459'
+            self.__nicks = {self.__fold(nick): nick for nick in self.__nicks.values()}
+            self.__online.clear()
+            self.__subscribed.clear()
+            self.__polled.clear()
+            self.__pending_chunks.clear()
+            if PresenceTracker.MONITOR in isupport:
+                self.__mode = PresenceTracker.MONITOR
+            elif PresenceTracker.WATCH in isupport:
+                self.__mode = PresenceTracker.WATCH
+            else:
+                self.__mode = PresenceTracker.ISON
+            mode, nicks = self.__mode, list(self.__nicks.values())
+        self.__subscribe(mode, nicks)
+
+    def __subscribe(self, mode, nicks):
+        """Subscribes to nicknames up to the server's limit, and polls the rest."""
+        if mode == PresenceTracker.ISON:
+            with self.__lock:
+                self.__polled.update(self.__fold(nick) for nick in nicks)
+            self.__send_ison(nicks)
+            return
+
+        limit = self.__connection.isupport.get(mode)
+        with self.__lock:
+            room = int(limit) - len(self.__subscribed) if limit and limit.isdigit() else len(nicks)
+            subscribed, polled = nicks[:max(0, room)], nicks[max(0, room):]
+            self.__subscribed.update(self.__fold(nick) for nick in subscribed)
+            self.__polled.update(self.__fold(nick) for nick in polled)
+        if mode == PresenceTracker.MONITOR:
+            for chunk in chunk_targets(f'{Commands.MONITOR} + ', subscribed, ','):
+                self.__connection.cmd_monitor(subcommand='+', targets=chunk)
+        else:
+            for chunk in chunk_targets(f'{Commands.WATCH} ', [f'+{nick}' for nick in subscribed], ' '):
+                self.__connection.cmd_watch(added=[target[1:] for target in chunk])
+        if polled:
+            self.__send_ison(polled)
+
+    def __unsubscribe(self, mode, nicks):
+        if mode == PresenceTracker.MONITOR:
+            for chunk in chunk_targets(f'{Commands.MONITOR} - ', nicks, ','):
+                self.__connection.cmd_monitor(subcommand='-', targets=chunk)
+        elif mode == PresenceTracker.WATCH:
+            for chunk in chunk_targets(f'{Commands.WATCH} ', [f'-{nick}' for nick in nicks], ' '):
+                self.__connection.cmd_watch(removed=[target[1:] for target in chunk])
+
+    def __send_ison(self, nicks):
+        """Queries the presence of nicknames with as few ISON lines as possible."""
+        chunks = chunk_targets(f'{Commands.ISON} ', nicks, ' ')
+        with self.__lock:
+            # The server answers in order, so each reply answers the oldest unanswered chunk.
+            self.__pending_chunks.extend([self.__fold(nick) for nick in chunk] for chunk in chunks)
+        for chunk in chunks:
+            self.__connection.cmd_ison(nicknames=chunk)
+
+    def __poll(self):
+        while not self.__stopped.wait(self.__poll_interval):
+            if not self.__connection.is_connection_alive:
+                continue
+            with self.__lock:
+                # A poll is skipped while the previous one has not been answered.
+                nicks = [] if self.__pending_chunks else [self.__nicks[lower] for lower in self.__polled]
+            if nicks:
+                self.__send_ison(nicks)
+
+    def __process(self, connection, message):
+        """Processor which records the presence notifications and replies of the server."""
+        command = message.command
+        if command in (Replies.RPL_ENDOFMOTD, Replies.ERR_NOMOTD):
+            self.__subscribe_all()
+        elif command == Replies.RPL_ISON:
+            with self.__lock:
+                chunk = self.__pending_chunks.popleft() if self.__pending_chunks else []
+            online = {self.__fold(nick) for nick in message.text.split()}
+            self.__update({lower: lower in online for lower in chunk})
+        elif command in (Replies.RPL_MONONLINE, Replies.RPL_MONOFFLINE):
+            # Online targets are sent as `nick!user@host`, offline ones as `nick`.
+            targets = [target.split('!', 1)[0] for target in message.text.split(',') if target]
+            self.__update({self.__fold(nick): command == Replies.RPL_MONONLINE for nick in targets})
+        elif command in (Replies.RPL_LOGON, Replies.RPL_NOWON, Replies.RPL_LOGOFF, Replies.RPL_NOWOFF) \
+                and len(message.args) > 1:
+            online = command in (Replies.RPL_LOGON, Replies.RPL_NOWON)
+            self.__update({self.__fold(message.args[1]): online})
+        elif command in (Replies.ERR_MONLISTFULL, Replies.ERR_TOOMANYWATCH) and len(message.args) > 2:
+            # The server's list is full; the rejected nicknames are polled instead.
+            separator = ',' if command == Replies.ERR_MONLISTFULL else ' '
+            targets = message.args[2] if command == Replies.ERR_MONLISTFULL else message.args[1]
+            rejected = []
+            with self.__lock:
+                for nick in targets.split(separator):
+                    lower = self.__fold(nick)
+                    if lower in self.__subscribed:
+                        self.__subscribed.discard(lower)
+                        self.__polled.add(lower)
+                        rejected.append(self.__nicks[lower])
+            if rejected:
+                self.__send_ison(rejected)
+        return message
+
+    def __update(self, presences):
+        """Records presences by lowercased nickname, and reports the ones which changed."""
+        changed = []
+        with self.__lock:
+            for lower, online in presences.items():
+                if lower in self.__nicks and self.__online.get(lower) is not online:
+                    self.__online[lower] = online
+                    changed.append((self.__nicks[lower], online))
+        if self.__on_change is not None:
+            for nick, online in changed:
+                self.__on_change(nick, online)
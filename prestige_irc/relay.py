@@ -0,0 +1,181 @@
+import socket
+import threading
+
+from prestige_irc.commands import Commands
+from prestige_irc.message import MAX_LINE_LENGTH, irc_lower
+
+_ACTION = b'\x01ACTION '
+
+
+def locate_fields(raw_bytes):
+    """
+    Finds the nick of the sender and the trailing text of a raw message, without decoding it.
+
+    Parameters
+    ----------
+    raw_bytes: bytes
+        The raw message, without a line ending.
+
+    Returns
+    -------
+    tuple:
+        The start and end offsets of the nick, which are equal if the message has no prefix,
+        and the offset the trailing text starts at, which is the length of the message if it has no text.
+    """
+    position = 0
+    if raw_bytes[:1] == b'@':
+        position = raw_bytes.find(b' ') + 1
+    nick_start = nick_end = position
+    if raw_bytes[position:position + 1] == b':':
+        prefix_end = raw_bytes.find(b' ', position)
+        if prefix_end < 0:
+            return position, position, len(raw_bytes)
+        nick_start = position + 1
+        nick_end = raw_bytes.find(b'!', nick_start, prefix_end)
+        if nick_end < 0:
+            nick_end = prefix_end
+        position = prefix_end + 1
+    text_start = raw_bytes.find(b' :', position)
+    if text_start >= 0:
+        return nick_start, nick_end, text_start + 2
+    # Without a `:`, the text is the last parameter.
+    return nick_start, nick_end, raw_bytes.rfind(b' ', position) + 1 or len(raw_bytes)
+
+
+def _utf8_boundary(data, end):
+    """Moves `end` back to the start of the UTF-8 character it falls inside of, so a character is not split."""
+    while 0 < end < len(data) and data[end] & 0xC0 == 0x80:
+        end -= 1
+    return end
+
+
+class Relay(object):
+
+    """
+    Forwards channel messages from connections to channels on other connections, e.g. to bridge two networks.
+
+    A message is forwarded by slicing the raw bytes it was received as: the prefix of the sender is dropped,
+    the target is replaced by the destination channel, and the nick of the sender is optionally put before the text.
+    The pieces are written with a single `Connection.send_buffers` call, so the message is neither decoded
+    nor parsed again, and its text is copied at most once.
+    The relay is a processor, so messages are forwarded on the thread which receives them, in the order they were
+    received.
+    """
+
+    def __init__(self, commands=(Commands.PRIVMSG, Commands.NOTICE), show_nick=True, casemapping='rfc1459'):
+        """
+        Creates a relay without routes; add routes with `add_route`, and the relay to the source connections
+        with `Connection.add_processor`.
+
+        Parameters
+        ----------
+        commands: collections.iterable (optional)
+            The commands of the messages which are forwarded.
+            Default value is PRIVMSG and NOTICE.
+        show_nick: bool (optional)
+            If the nick of the sender is put before the text, as `<nick> text`.
+            Default value is True.
+        casemapping: str (optional)
+            The casemapping used to compare channel names, see `irc_lower`.
+            Default value is 'rfc1459'.
+        """
+        self.__commands = {command: command.encode('ascii') for command in commands}
+        self.__show_nick = show_nick
+        self.__casemapping = casemapping
+        # Maps each (source connection, lowercased channel) to a list of (destination connection, encoded channel).
+        self.__routes = {}
+        self.__lock = threading.Lock()
+
+    def __call__(self, connection, message):
+        """
+        A processor which forwards the messages sent to the channels routed from `connection`.
+
+        Parameters
+        ----------
+        connection: Connection
+            The connection the message was received over.
+        message: IRCMessage
+            The message received.
+
+        Returns
+        -------
+        IRCMessage:
+            `message`, unchanged.
+        """
+        if self.__is_routed(connection, message):
+            self.__forward(connection, message)
+        return message
+
+    def add_route(self, source, channel, destination, destination_channel=None):
+        """
+        Forwards the messages sent to `channel` over `source` to a channel over `destination`.
+
+        Parameters
+        ----------
+        source: IRCConnection
+            The connection the messages are received over.
+        channel: str
+            The channel the messages are sent to.
+        destination: IRCConnection
+            The connection the messages are forwarded over.
+        destination_channel: str (optional)
+            The channel the messages are forwarded to.
+            Default value is None, which uses `channel`.
+        """
+        key = (source, irc_lower(channel, self.__casemapping))
+        target = (destination_channel or channel).encode('utf-8')
+        with self.__lock:
+            routes = list(self.__routes.get(key, ()))
+            routes.append((destination, target))
+            self.__routes[key] = routes
+
+    def remove_route(self, source, channel, destination):
+        """
+        Stops forwarding the messages sent to `channel` over `source` over `destination`.
+
+        Parameters
+        ----------
+        source: IRCConnection
+            The connection the messages are received over.
+        channel: str
+            The channel the messages are sent to.
+        destination: IRCConnection
+            The connection the messages were forwarded over.
+        """
+        key = (source, irc_lower(channel, self.__casemapping))
+        with self.__lock:
+            routes = [route for route in self.__routes.get(key, ()) if route[0] is not destination]
+            if routes:
+                self.__routes[key] = routes
+            else:
+                self.__routes.pop(key, None)
+
+    def __is_routed(self, connection, message):
+        # The connection's own messages are not forwarded, so routes in both directions do not loop.
+        return message.command in self.__commands and message.raw_bytes is not None \
+            and (connection, irc_lower(message.target, self.__casemapping)) in self.__routes \
+            and message.nick != getattr(connection, 'nick', None)
+
+    def __forward(self, connection, message):
+        routes = self.__routes.get((connection, irc_lower(message.target, self.__casemapping)), ())
+        raw = memoryview(message.raw_bytes)
+        nick_start, nick_end, text_start = locate_fields(message.raw_bytes)
+        text = raw[text_start:]
+        # `/me` actions keep their CTCP framing, with the nick inside of it.
+        label, tail = [], b'\r\n'
+        if self.__show_nick and nick_end > nick_start:
+            if text[:len(_ACTION)] == _ACTION:
+                text = text[len(_ACTION):-1] if text[-1:] == b'\x01' else text[len(_ACTION):]
+                label, tail = [_ACTION], b'\x01\r\n'
+            label += [b'<', raw[nick_start:nick_end], b'> ']
+        command = self.__commands[message.command]
+        for destination, target in routes:
+            buffers = [command, b' ', target, b' :'] + label
+            room = MAX_LINE_LENGTH - sum(len(buffer) for buffer in buffers) - len(tail)
+            # The server truncates lines which are too long; the text is shortened instead, on a character boundary.
+            end = len(text) if len(text) <= room else _utf8_boundary(text, max(0, room))
+            # A destination which is disconnected, or whose socket fails, must not stop the others.
+            try:
+                destination.send_buffers(buffers + [text[:end], tail])
+            except socket.error:
+                pass
@@ -0,0 +1,43 @@
+class Replies:
+
+    """A list of IRC numeric replies, which are handled in `IRCConnection`.
+
+    This list of replies is based on:
+        https://modern.ircdocs.horse/#numerics
+    """
+
+    RPL_WELCOME = '001'
+    RPL_YOURHOST = '002'
+    RPL_CREATED = '003'
+    RPL_MYINFO = '004'
+    RPL_ISUPPORT = '005'
+    RPL_ISON = '303'
+    RPL_ENDOFWHO = '315'
+    RPL_NOTOPIC = '331'
+    RPL_TOPIC = '332'
+    RPL_WHOREPLY = '352'
+    RPL_NAMREPLY = '353'
+    RPL_ENDOFNAMES = '366'
+    RPL_ENDOFMOTD = '376'
+    ERR_NOSUCHNICK = '401'
+    ERR_UNKNOWNCOMMAND = '421'
+    ERR_NOMOTD = '422'
+    ERR_NICKNAMEINUSE = '433'
+    ERR_NOTREGISTERED = '451'
+    ERR_TOOMANYWATCH = '512'
+    RPL_LOGON = '600'
+    RPL_LOGOFF = '601'
+    RPL_WATCHOFF = '602'
+    RPL_NOWON = '604'
+    RPL_NOWOFF = '605'
+    RPL_MONONLINE = '730'
+    RPL_MONOFFLINE = '731'
+    RPL_MONLIST = '732'
+    RPL_ENDOFMONLIST = '733'
+    ERR_MONLISTFULL = '734'
+    RPL_LOGGEDIN = '900'
+    RPL_SASLSUCCESS = '903'
+    ERR_SASLFAIL = '904'
+    ERR_SASLTOOLONG = '905'
+    ERR_SASLABORTED = '906'
+    ERR_SASLALREADY = '907'
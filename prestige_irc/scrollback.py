@@ -0,0 +1,304 @@
+import array
+import collections
+import threading
+import time
+
+from prestige_irc.commands import Commands
+from prestige_irc.message import CHANNEL_PREFIXES, IRCMessage, irc_lower
+
+
+class ChannelBuffer(object):
+
+    """
+    A fixed-capacity ring buffer of the most recent raw lines of a channel.
+
+    The lines are stored back to back in a single preallocated `bytearray`, and their positions, lengths and timestamps
+    in preallocated `array`s, so a line costs its own bytes plus 20 bytes, instead of a Python object per field.
+    Once either the line or the byte capacity is reached, the oldest lines are overwritten.
+    """
+
+    def __init__(self, max_lines, max_bytes):
+        """
+        Allocates the buffer.
+
+        Parameters
+        ----------
+        max_lines: int
+            The maximum number of lines kept.
+        max_bytes: int
+            The number of bytes allocated for the lines. Lines longer than this are truncated.
+        """
+        self.__data = bytearray(max_bytes)
+        self.__positions = array.array('Q', bytes(8 * max_lines))
+        self.__lengths = array.array('I', bytes(4 * max_lines))
+        self.__times = array.array('d', bytes(8 * max_lines))
+        # The slot of the oldest line, the number of lines, and the position the next line is written at.
+        # Positions count every byte ever written, so a line is overwritten once the write position is more than
+        # the capacity past it; its offset in the buffer is its position modulo the capacity.
+        self.__head = 0
+        self.__count = 0
+        self.__write = 0
+
+    def __len__(self):
+        return self.__count
+
+    @staticmethod
+    def footprint(max_lines, max_bytes):
+        """
+        Computes the number of bytes a buffer allocates for its lines.
+
+        Parameters
+        ----------
+        max_lines: int
+            The maximum number of lines kept.
+        max_bytes: int
+            The number of bytes allocated for the lines.
+
+        Returns
+        -------
+        int:
+            The number of bytes allocated.
+        """
+        return max_bytes + 20 * max_lines
+
+    def append(self, line, timestamp):
+        """
+        Adds a line, overwriting the oldest lines if there is no room for it.
+
+        Parameters
+        ----------
+        line: bytes
+            The raw line.
+        timestamp: float
+            The time the line was received, in seconds since the epoch.
+        """
+        capacity = len(self.__data)
+        size = min(len(line), capacity)
+        if self.__count == len(self.__positions):
+            self.__evict()
+
+        position = self.__write
+        offset = position % capacity
+        if offset + size > capacity:
+            # Lines are never split; the rest of the buffer is skipped and the line is written at its start.
+            position += capacity - offset
+            offset = 0
+        end = position + size
+        while self.__count and self.__positions[self.__head] < end - capacity:
+            self.__evict()
+
+        self.__data[offset:offset + size] = line[:size]
+        slot = (self.__head + self.__count) % len(self.__positions)
+        self.__positions[slot] = position
+        self.__lengths[slot] = size
+        self.__times[slot] = timestamp
+        self.__count += 1
+        self.__write = end
+
+    def __evict(self):
+        self.__head = (self.__head + 1) % len(self.__positions)
+        self.__count -= 1
+
+    def entries(self, limit=None, since=None):
+        """
+        Gets the most recent lines.
+
+        Parameters
+        ----------
+        limit: int (optional)
+            The maximum number of lines to return.
+            Default value is None, which returns every line.
+        since: float (optional)
+            Only lines received at or after this time, in seconds since the epoch, are returned.
+            Default value is None.
+
+        Returns
+        -------
+        list:
+            (timestamp, bytes) tuples, oldest first.
+        """
+        count = self.__count if limit is None else min(limit, self.__count)
+        entries = []
+        for i in range(self.__count - 1, self.__count - 1 - count, -1):
+            slot = (self.__head + i) % len(self.__positions)
+            timestamp = self.__times[slot]
+            if since is not None and timestamp < since:
+                break
+            offset = self.__positions[slot] % len(self.__data)
+            entries.append((timestamp, bytes(self.__data[offset:offset + self.__lengths[slot]])))
+        entries.reverse()
+        return entries
+
+
+class Scrollback(object):
+
+    """
+    Keeps the most recent lines of each channel in memory-bounded `ChannelBuffer`s.
+
+    Add it to an `IRCConnection` with the `scrollback` constructor parameter (or `Connection.add_processor`)
+    to record channel messages as they are received.
+    The buffers of all channels together are kept under a global memory cap by discarding the buffers of the channels
+    which were least recently written to or read from.
+    """
+
+    def __init__(self, lines_per_channel=100, bytes_per_channel=32768, max_memory=64 * 1024 * 1024,
+                 commands=(Commands.PRIVMSG, Commands.NOTICE), casemapping='rfc1459'):
+        """
+        Creates an empty scrollback.
+
+        Parameters
+        ----------
+        lines_per_channel: int (optional)
+            The maximum number of lines kept for each channel.
+            Default value is 100.
+        bytes_per_channel: int (optional)
+            The number of bytes allocated for the lines of each channel.
+            Default value is 32768.
+        max_memory: int (optional)
+            The maximum number of bytes allocated for the lines of all channels together.
+            At least one channel is always kept.
+            Default value is 64 MiB.
+        commands: collections.iterable (optional)
+            The commands of the messages which are recorded when used as a processor.
+            Default value is PRIVMSG and NOTICE.
+        casemapping: str (optional)
+            The casemapping used to compare channel names, see `irc_lower`.
+            Default value is 'rfc1459'.
+        """
+        self.__lines_per_channel = lines_per_channel
+        self.__bytes_per_channel = bytes_per_channel
+        self.__max_channels = max(1, max_memory // ChannelBuffer.footprint(lines_per_channel, bytes_per_channel))
+        self.__commands = frozenset(commands)
+        self.__casemapping = casemapping
+        # Buffers by lowercased channel name, least recently used first.
+        self.__buffers = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __call__(self, connection, message):
+        """
+        A processor which records channel messages with the configured commands.
+
+        Parameters
+        ----------
+        connection: Connection
+            The connection the message was received over.
+        message: IRCMessage
+            The message received.
+
+        Returns
+        -------
+        IRCMessage:
+            `message`, unchanged.
+        """
+        if message.command in self.__commands and message.target[:1] in CHANNEL_PREFIXES:
+            self.append(channel=message.target, line=message.encoded, timestamp=message.time)
+        return message
+
+    @property
+    def channels(self):
+        """
+        Returns
+        -------
+        list:
+            The lowercased names of the channels which have a buffer, least recently used first.
+        """
+        with self.__lock:
+            return list(self.__buffers)
+
+    @property
+    def memory_usage(self):
+        """
+        Returns
+        -------
+        int:
+            The number of bytes allocated for the lines of all channels.
+        """
+        return len(self.__buffers) * ChannelBuffer.footprint(self.__lines_per_channel, self.__bytes_per_channel)
+
+    def append(self, channel, line, timestamp=None):
+        """
+        Records a line in the buffer of `channel`, creating the buffer if needed.
+
+        Parameters
+        ----------
+        channel: str
+            The channel the line was sent to.
+        line: bytes
+            The raw line.
+        timestamp: float (optional)
+            The time the line was received, in seconds since the epoch.
+            Default value is None, which uses the current time.
+        """
+        key = irc_lower(channel, self.__casemapping)
+        with self.__lock:
+            buffer = self.__buffers.get(key)
+            if buffer is None:
+                while len(self.__buffers) >= self.__max_channels:
+                    self.__buffers.popitem(last=False)
+                buffer = self.__buffers[key] = ChannelBuffer(self.__lines_per_channel, self.__bytes_per_channel)
+            else:
+                self.__buffers.move_to_end(key)
+            buffer.append(line, time.time() if timestamp is None else timestamp)
+
+    def entries(self, channel, limit=None, since=None):
+        """
+        Gets the most recent lines of `channel`, with the times they were received.
+
+        Parameters
+        ----------
+        channel: str
+            The channel.
+        limit: int (optional)
+            The maximum number of lines to return.
+            Default value is None, which returns every line kept.
+        since: float (optional)
+            Only lines received at or after this time, in seconds since the epoch, are returned.
+            Default value is None.
+
+        Returns
+        -------
+        list:
+            (timestamp, bytes) tuples, oldest first.
+        """
+        key = irc_lower(channel, self.__casemapping)
+        with self.__lock:
+            buffer = self.__buffers.get(key)
+            if buffer is None:
+                return []
+            self.__buffers.move_to_end(key)
+            return buffer.entries(limit=limit, since=since)
+
+    def lines(self, channel, limit=None, since=None):
+        """
+        Gets the most recent raw lines of `channel`; see `Scrollback.entries`.
+
+        Returns
+        -------
+        list:
+            The raw lines, oldest first.
+        """
+        return [line for _, line in self.entries(channel, limit=limit, since=since)]
+
+    def messages(self, channel, limit=None, since=None):
+        """
+        Gets the most recent messages of `channel`, parsed into `IRCMessage`s; see `Scrollback.entries`.
+
+        Returns
+        -------
+        list:
+            The messages, oldest first.
+        """
+        return [IRCMessage(line.decode('utf-8', 'replace'), raw_bytes=line)
+                for line in self.lines(channel, limit=limit, since=since)]
+
+    def discard(self, channel):
+        """
+        Discards the buffer of `channel`, e.g. after parting it.
+
+        Parameters
+        ----------
+        channel: str
+            The channel.
+        """
+        with self.__lock:
+            self.__buffers.pop(irc_lower(channel, self.__casemapping), None)
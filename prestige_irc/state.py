@@ -0,0 +1,448 @@
+import json
+import os
+import threading
+import time
+import zlib
+
+from prestige_irc.commands import Commands
+from prestige_irc.message import IRCBatch, chunk_targets, irc_lower
+from prestige_irc.replies import Replies
+
+# The version of the snapshot format written by `ConnectionState.save`.
+SNAPSHOT_VERSION = 1
+
+
+class _Channel(object):
+
+    """The known state of a joined channel."""
+
+    def __init__(self, name, topic=''):
+        self.name = name
+        self.topic = topic
+        # Maps each lowercased nick to the nick and its membership prefixes, e.g. ['Nick', '@+'].
+        self.members = {}
+        # If the member list has been confirmed by the server since the connection registered.
+        self.synced = False
+
+
+class ConnectionState(object):
+
+    """
+    Tracks the channels, members, topics and user hosts of an `IRCConnection`,
+    and persists them as compressed snapshots so a restarted bot can answer queries before the server has resent them.
+
+    Snapshots are written periodically and when the tracker is stopped, and are replaced atomically,
+    so a crash never leaves a partially written snapshot behind. After a restart, the channels of the snapshot are
+    rejoined, the member lists the server sends on join replace the restored ones, and WHO is only requested for
+    channels with members whose host is not known yet, instead of for every channel.
+    """
+
+    def __init__(self, connection, path, interval=300, rejoin=True):
+        """
+        Readies the tracker for `connection`; call `restore` to load the previous snapshot, then `start`.
+
+        Parameters
+        ----------
+        connection: IRCConnection
+            The connection to track.
+        path: str
+            The file the snapshots are written to.
+        interval: float (optional)
+            The number of seconds between snapshots; a snapshot is only written if the state changed.
+            Default value is 300.
+        rejoin: bool (optional)
+            If the channels of the restored snapshot are joined once the connection has registered.
+            Default value is True.
+        """
+        self.__connection = connection
+        self.__path = path
+        self.__interval = interval
+        self.__rejoin = rejoin
+        self.__casemapping = 'rfc1459'
+        self.__isupport = {}
+        self.__channels = {}
+        # Maps each lowercased nick which shares a channel with the connection to the nick and its host.
+        self.__users = {}
+        # The member lists being received in RPL_NAMREPLY, by lowercased channel.
+        self.__names = {}
+        self.__changed = False
+        self.__lock = threading.RLock()
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    @property
+    def channels(self):
+        """
+        Returns
+        -------
+        list:
+            The names of the channels the connection is in, or was in when the restored snapshot was taken.
+        """
+        with self.__lock:
+            return [channel.name for channel in self.__channels.values()]
+
+    @property
+    def isupport(self):
+        """
+        Returns
+        -------
+        dict:
+            The features advertised by the server, or the restored ones until the server has advertised them.
+        """
+        return self.__connection.isupport or dict(self.__isupport)
+
+    def members(self, channel):
+        """
+        Gets the members of a channel.
+
+        Parameters
+        ----------
+        channel: str
+            The channel.
+
+        Returns
+        -------
+        dict:
+            The nick of each member, mapped to its membership prefixes (e.g. '@' for operators).
+        """
+        with self.__lock:
+            state = self.__channels.get(self.__fold(channel))
+            return dict(state.members.values()) if state is not None else {}
+
+    def topic(self, channel):
+        """
+        Gets the topic of a channel.
+
+        Parameters
+        ----------
+        channel: str
+            The channel.
+
+        Returns
+        -------
+        str|None:
+            The topic, which is empty if none is set, or None if the connection is not in the channel.
+        """
+        with self.__lock:
+            state = self.__channels.get(self.__fold(channel))
+            return state.topic if state is not None else None
+
+    def host(self, nick):
+        """
+        Gets the host of a user who shares a channel with the connection.
+
+        Parameters
+        ----------
+        nick: str
+            The nick of the user.
+
+        Returns
+        -------
+        str|None:
+            The host (nick!user@host), or None if it is not known.
+        """
+        with self.__lock:
+            user = self.__users.get(self.__fold(nick))
+            return user[1] if user is not None else None
+
+    def is_synced(self, channel):
+        """
+        Checks if the member list of a channel has been received from the server since the connection registered,
+        rather than restored from a snapshot.
+
+        Parameters
+        ----------
+        channel: str
+            The channel.
+
+        Returns
+        -------
+        bool:
+            If the member list is up to date.
+        """
+        with self.__lock:
+            state = self.__channels.get(self.__fold(channel))
+            return state is not None and state.synced
+
+    def start(self):
+        """Starts tracking the connection and writing periodic snapshots. Does nothing if already started."""
+        if self.__thread is not None:
+            return
+        self.__stopped.clear()
+        self.__connection.add_processor(self.__process)
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Stops tracking the connection, and writes a final snapshot."""
+        if self.__thread is None:
+            return
+        self.__stopped.set()
+        self.__thread.join()
+        self.__thread = None
+        self.__connection.remove_processor(self.__process)
+        self.save()
+
+    def snapshot(self):
+        """
+        Returns
+        -------
+        dict:
+            The state, in the form written by `save`.
+        """
+        with self.__lock:
+            return {
+                'version': SNAPSHOT_VERSION,
+                'time': time.time(),
+                'casemapping': self.__casemapping,
+                'isupport': self.isupport,
+                'channels': [[channel.name, channel.topic, list(channel.members.values())]
+                             for channel in self.__channels.values()],
+                'users': list(self.__users.values()),
+            }
+
+    def save(self):
+        """Writes a snapshot of the state: compact JSON, compressed with zlib, replacing the previous snapshot."""
+        with self.__lock:
+            data = zlib.compress(json.dumps(self.snapshot(), separators=(',', ':')).encode('utf-8'))
+            self.__changed = False
+        temporary = f'{self.__path}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.__path)
+
+    def restore(self):
+        """
+        Loads the snapshot written by `save`, replacing the current state.
+
+        Returns
+        -------
+        bool:
+            If a snapshot was loaded; False if there is none, or it cannot be read.
+        """
+        try:
+            with open(self.__path, 'rb') as file:
+                snapshot = json.loads(zlib.decompress(file.read()).decode('utf-8'))
+        except (OSError, ValueError, zlib.error):
+            return False
+        if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+            return False
+        with self.__lock:
+            self.__casemapping = snapshot['casemapping']
+            self.__isupport = snapshot['isupport']
+            self.__channels = {}
+            for name, topic, members in snapshot['channels']:
+                channel = self.__channels[self.__fold(name)] = _Channel(name, topic)
+                channel.members = {self.__fold(nick): [nick, prefixes] for nick, prefixes in members}
+            self.__users = {self.__fold(nick): [nick, host] for nick, host in snapshot['users']}
+        return True
+
+    def __fold(self, name):
+        return irc_lower(name, self.__casemapping)
+
+    def __run(self):
+        while not self.__stopped.wait(self.__interval):
+            if self.__changed:
+                self.save()
+
+    def __process(self, connection, message):
+        """Processor which applies the changes announced by the server to the state."""
+        with self.__lock:
+            self.__apply(connection, message)
+        return message
+
+    def __apply(self, connection, message):
+        if isinstance(message, IRCBatch):
+            # Netsplits and netjoins arrive as batches of QUITs and JOINs; chat history is a replay of past events.
+            if not message.type.endswith('chathistory'):
+                for inner in message.messages:
+                    self.__apply(connection, inner)
+            return
+        handler = self.__handlers.get(message.command)
+        if handler is not None:
+            handler(self, connection, message)
+
+    def __on_welcome(self, connection, message):
+        for channel in self.__channels.values():
+            channel.synced = False
+        self.__names.clear()
+        if self.__rejoin and self.__channels:
+            for chunk in chunk_targets(f'{Commands.JOIN} ', [channel.name for channel in self.__channels.values()],
+                                       ','):
+                connection.cmd_join(channels=chunk)
+
+    def __on_isupport(self, connection, message):
+        casemapping = connection.isupport.get('CASEMAPPING') or 'rfc1459'
+        if casemapping != self.__casemapping:
+            self.__casemapping = casemapping
+            for channel in self.__channels.values():
+                channel.members = {self.__fold(nick): [nick, prefixes] for nick, prefixes in channel.members.values()}
+            self.__channels = {self.__fold(channel.name): channel for channel in self.__channels.values()}
+            self.__users = {self.__fold(nick): [nick, host] for nick, host in self.__users.values()}
+
+    def __on_join(self, connection, message):
+        key = self.__fold(message.target)
+        if self.__is_self(connection, message.nick):
+            if key not in self.__channels:
+                self.__channels[key] = _Channel(message.target)
+            self.__channels[key].synced = False
+        else:
+            channel = self.__channels.get(key)
+            if channel is None:
+                return
+            nick = self.__fold(message.nick)
+            channel.members[nick] = [message.nick, '']
+            self.__users[nick] = [message.nick, message.host]
+        self.__changed = True
+
+    def __on_part(self, connection, message):
+        self.__remove_member(connection, message.target, message.nick)
+
+    def __on_kick(self, connection, message):
+        if len(message.args) > 1:
+            self.__remove_member(connection, message.target, message.args[1])
+
+    def __remove_member(self, connection, channel, nick):
+        key = self.__fold(channel)
+        if self.__is_self(connection, nick):
+            self.__channels.pop(key, None)
+            self.__names.pop(key, None)
+            self.__prune_users()
+        elif key in self.__channels:
+            lower = self.__fold(nick)
+            self.__channels[key].members.pop(lower, None)
+            if not any(lower in other.members for other in self.__channels.values()):
+                self.__users.pop(lower, None)
+        self.__changed = True
+
+    def __on_quit(self, connection, message):
+        lower = self.__fold(message.nick)
+        for channel in self.__channels.values():
+            channel.members.pop(lower, None)
+        self.__users.pop(lower, None)
+        self.__changed = True
+
+    def __on_nick(self, connection, message):
+        old, new = self.__fold(message.nick), self.__fold(message.target)
+        for channel in self.__channels.values():
+            member = channel.members.pop(old, None)
+            if member is not None:
+                channel.members[new] = [message.target, member[1]]
+        user = self.__users.pop(old, None)
+        if user is not None:
+            host = user[1]
+            self.__users[new] = [message.target, f'{message.target}{host[host.find("!"):]}' if host else host]
+        self.__changed = True
+
+    def __on_topic(self, connection, message):
+        # TOPIC is sent by a user with the channel as target; RPL_TOPIC and RPL_NOTOPIC have the nick first.
+        name = message.target if message.command == Commands.TOPIC else message.args[1]
+        channel = self.__channels.get(self.__fold(name))
+        if channel is not None:
+            channel.topic = message.text if message.command != Replies.RPL_NOTOPIC else ''
+            self.__changed = True
+
+    def __on_mode(self, connection, message):
+        channel = self.__channels.get(self.__fold(message.target))
+        if channel is None or len(message.args) < 2:
+            return
+        modes, symbols = self.__prefixes(connection)
+        # Modes which always take a parameter, and modes which only take one when they are set.
+        list_modes, always, when_set = ((self.isupport.get('CHANMODES') or 'beI,k,l,imnpst').split(',') + ['', ''])[:3]
+        params = list(message.args[2:])
+        adding = True
+        for mode in message.args[1]:
+            if mode in '+-':
+                adding = mode == '+'
+            elif mode in modes:
+                member = channel.members.get(self.__fold(params.pop(0))) if params else None
+                if member is not None:
+                    symbol = symbols[modes.index(mode)]
+                    held = set(member[1]) | {symbol} if adding else set(member[1]) - {symbol}
+                    member[1] = ''.join(prefix for prefix in symbols if prefix in held)
+                    self.__changed = True
+            elif mode in list_modes or mode in always or (adding and mode in when_set):
+                if params:
+                    params.pop(0)
+
+    def __on_names(self, connection, message):
+        if len(message.args) < 4:
+            return
+        key = self.__fold(message.args[2])
+        if key not in self.__channels:
+            return
+        _, symbols = self.__prefixes(connection)
+        names = self.__names.setdefault(key, {})
+        for entry in message.text.split():
+            # With multi-prefix every prefix is sent, and with userhost-in-names the host is as well.
+            prefixes = entry[:len(entry) - len(entry.lstrip(symbols))]
+            host = entry[len(prefixes):]
+            nick = host.split('!', 1)[0]
+            lower = self.__fold(nick)
+            names[lower] = [nick, prefixes]
+            if '!' in host:
+                self.__users[lower] = [nick, host]
+            elif lower not in self.__users:
+                self.__users[lower] = [nick, None]
+
+    def __on_end_of_names(self, connection, message):
+        if len(message.args) < 2:
+            return
+        key = self.__fold(message.args[1])
+        channel = self.__channels.get(key)
+        names = self.__names.pop(key, None)
+        if channel is None or names is None:
+            return
+        channel.members = names
+        channel.synced = True
+        self.__prune_users()
+        self.__changed = True
+        # Only the hosts which are not known from the snapshot, or an earlier WHO, are requested.
+        if any(self.__users.get(lower, (None, None))[1] is None for lower in names):
+            connection.send_command(command=Commands.WHO, params=channel.name)
+
+    def __on_who_reply(self, connection, message):
+        # <me> <channel> <user> <host> <server> <nick> <flags> :<hopcount> <real name>
+        if len(message.args) < 7:
+            return
+        user, host, nick = message.args[2], message.args[3], message.args[5]
+        lower = self.__fold(nick)
+        if lower in self.__users:
+            self.__users[lower] = [nick, f'{nick}!{user}@{host}']
+            self.__changed = True
+
+    def __prune_users(self):
+        """Forgets the users who no longer share a channel with the connection."""
+        members = set()
+        for channel in self.__channels.values():
+            members.update(channel.members)
+        for lower in [lower for lower in self.__users if lower not in members]:
+            del self.__users[lower]
+
+    def __prefixes(self, connection):
+        """Parses the PREFIX feature, e.g. '(ov)@+', into the membership modes and their prefixes."""
+        prefix = self.isupport.get('PREFIX') or '(ov)@+'
+        modes, _, symbols = prefix[1:].partition(')')
+        return modes, symbols
+
+    def __is_self(self, connection, nick):
+        return self.__fold(nick) == self.__fold(connection.nick)
+
+    __handlers = {
+        Replies.RPL_WELCOME: __on_welcome,
+        Replies.RPL_ISUPPORT: __on_isupport,
+        Commands.JOIN: __on_join,
+        Commands.PART: __on_part,
+        Commands.KICK: __on_kick,
+        Commands.QUIT: __on_quit,
+        Commands.NICK: __on_nick,
+        Commands.TOPIC: __on_topic,
+        Replies.RPL_TOPIC: __on_topic,
+        Replies.RPL_NOTOPIC: __on_topic,
+        Commands.MODE: __on_mode,
+        Replies.RPL_NAMREPLY: __on_names,
+        Replies.RPL_ENDOFNAMES: __on_end_of_names,
+        Replies.RPL_WHOREPLY: __on_who_reply,
+    }